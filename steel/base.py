@@ -1,18 +1,58 @@
+import array
 import collections
 import io
+import mmap
+import os
+import struct
+import sys
 
-from steel.common import meta, fields
+from steel.common import args, meta, fields, layout
 
 __all__ = ['Structure', 'StructureStreamer', 'StructureTuple']
 
 
+# Raw data that can be parsed in place, without copying it into a file first
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+# Record indexes start with a signature, then the size, modification time
+# and inode of the file they index, so that edits which leave the size alone
+# still get noticed, followed by the number of records and the number of key
+# fields, all little-endian
+INDEX_SIGNATURE = b'STEELID2'
+INDEX_HEADER = struct.Struct('<8sQQQQQ')
+
+# How much data to look through at first when searching for a terminator,
+# which doubles each time until the terminator is found
+FIND_SIZE = 256
+
+
 class StructureBase:
+    # Subclasses get their own attribute dictionaries as usual, but leaving
+    # them out here lets compact structures do without them entirely
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
-        self._file = len(args) > 0 and args[0] or None
+        if args and isinstance(args[0], BUFFER_TYPES):
+            self._file = BufferReader(args[0])
+            # Nothing else reads from this buffer, so fields at known
+            # offsets can be sliced out of it in any order
+            self._random_access = True
+        else:
+            self._file = len(args) > 0 and args[0] or None
+            self._random_access = False
         self._mode = self._file and 'rb' or 'wb'
         self._position = 0
-        self._write_buffer = b''
+        self._write_buffer = bytearray()
+        self._write_index = 0
+        self._write_needed = 0
+        self._write_terminator = None
         self._raw_values = {}
+        # Where each field was found in the original data, and which
+        # fields have been assigned since, so they can be written back
+        self._offsets = {}
+        self._modified = set()
+        # Calculated values that other fields have needed, until anything changes
+        self._calculated = {}
         self._parent = None
 
         if self._file and kwargs:
@@ -33,64 +73,300 @@ class StructureBase:
     def write(self, data):
         if self._mode != 'wb':
             raise IOError("not writable")
-        file = EOFBytesIO(self._write_buffer + data)
+
+        # Data just waits until the next field has enough of it to work
+        # with, so each write only costs as much as the data it provides
+        checked = len(self._write_buffer)
+        self._write_buffer += data
+        if len(self._write_buffer) < self._write_needed:
+            return
+        if self._write_terminator is not None:
+            # The field can't be finished until its terminator shows up,
+            # so only the new data needs to be checked for it
+            start = max(checked - len(self._write_terminator) + 1, 0)
+            if self._write_buffer.find(self._write_terminator, start) < 0:
+                return
+
+        view = memoryview(self._write_buffer)
+        file = EOFBufferReader(view)
+        items = list(self.__class__._fields.items())
         last_position = 0
-        for name, field in self.__class__._fields.items():
-            if name not in self.__dict__:
-                try:
+        try:
+            while self._write_index < len(items):
+                name, field = items[self._write_index]
+                if field.condition is not None and not field.is_present(self):
+                    self._raw_values.setdefault(name, b'')
+                elif name not in self.__dict__:
+                    field = field.for_instance(self)
+                    # The buffer gets trimmed once it's been used, so values
+                    # can't refer to it, and get copies of their data instead
                     try:
-                        bytes = field.read(file)
-                        value = field.decode(bytes)
-                    except fields.FullyDecoded as obj:
-                        bytes = obj.bytes
-                        value = obj.value
-                    self._raw_values[name] = bytes
+                        try:
+                            value_bytes = bytes(field.read(file))
+                            value = field.decode(value_bytes)
+                        except fields.FullyDecoded as obj:
+                            value_bytes = bytes(obj.bytes)
+                            value = detach(obj.value, self)
+                    except EOFError as error:
+                        available = len(view) - last_position
+                        needed = max(get_needed_size(field, available), getattr(error, 'needed', 0))
+                        self._write_needed = last_position + needed
+                        self._write_terminator = get_terminator(field)
+                        return
+                    self._raw_values[name] = value_bytes
                     self.__dict__[name] = value
                     last_position = file.tell()
-                except EOFError:
-                    file.seek(last_position)
-                    self._write_buffer = file.read()
-                else:
-                    self._write_buffer = b''
-        self._position += last_position
+                self._write_index += 1
+            self._write_needed = 0
+            self._write_terminator = None
+        finally:
+            # Only the data that hasn't been used yet needs to stick around
+            del file
+            view.release()
+            try:
+                del self._write_buffer[:last_position]
+            except BufferError:
+                # Something still refers to the buffer, like an error being raised
+                self._write_buffer = self._write_buffer[last_position:]
+            self._write_needed = max(self._write_needed - last_position, 0)
+            self._position += last_position
+
+    def feed(self, data):
+        # Like write(), but also reports whether all the fields are done,
+        # for data that arrives in pieces, from a socket or pipe
+        self.write(data)
+        return self._write_index >= len(self.__class__._fields)
+
+    def peek(self, size=1):
+        # Looks at upcoming data without reading it, if the file allows it
+        if self._mode != 'rb':
+            raise IOError("not readable")
+        return peek(self._file, size)
+
+    def readuntil(self, terminator):
+        # Reads up to and including the terminator, or to the end of the data
+        if self._mode != 'rb':
+            raise IOError("not readable")
+        value = read_until(self._file, terminator)
+        self._position += len(value)
+        return value
 
     def tell(self):
         return self._position
 
+    def _read_at(self, offset, size):
+        # Reads data at a given offset from the start of the structure,
+        # without moving on to any of the data in between
+        return self._file.buffer[offset:offset + size]
+
     def _extract(self, field):
         if field.name not in self._raw_values:
-            for name, other_field in self._fields.items():
-                if name not in self._raw_values:
-                    with other_field.for_instance(self):
-                        try:
-                            bytes = other_field.read(self)
-                        except fields.FullyDecoded as obj:
-                            bytes = obj.bytes
-                            self.__dict__[name] = obj.value
-                        self._raw_values[name] = bytes
-                if name == field.name:
-                    break
-        return self._raw_values[field.name]
-
-    def get_raw_bytes(self):
-        output = b''
+            self._read_through(field.name)
+        value_bytes = self._raw_values[field.name]
+        if isinstance(value_bytes, fields.Pieces):
+            value_bytes = self._raw_values[field.name] = value_bytes.get_bytes()
+        return value_bytes
+
+    def _read_through(self, name):
+        # Reads the data for the named field, along with any fields before it
+        if self._position == 0 and self._layout.fields:
+            if self._random_access and name in self._layout.offsets:
+                # The field's position is known ahead of time, so
+                # it can be read without touching any other fields
+                self._layout.fetch(self, name)
+                return
+
+            # Otherwise, the leading run of static fields
+            # can all be read and unpacked at once
+            self._layout.unpack(self)
+        for other_name, other_field in self._fields.items():
+            if other_name not in self._offsets and other_name not in self._layout.offsets:
+                start = self._position
+                if other_name in self._runs:
+                    # Later runs of static fields are read all at once too,
+                    # with each field's position worked out from the start
+                    run = self._runs[other_name]
+                    run.unpack(self)
+                    for run_name, field, run_start, run_end in run.fields:
+                        self._offsets[run_name] = (min(start + run_start, self._position),
+                                                   min(start + run_end, self._position))
+                    if name in run.offsets:
+                        break
+                    continue
+                if other_field.condition is not None and not other_field.is_present(self):
+                    # Left out of this structure, so it has no data at all
+                    self._raw_values.setdefault(other_name, b'')
+                elif other_name in self._raw_values:
+                    # Already assigned, so the original data only needs
+                    # to be skipped over to keep everything after it in step
+                    self._skip(other_field)
+                else:
+                    try:
+                        bytes = other_field.for_instance(self).read(self)
+                    except fields.FullyDecoded as obj:
+                        bytes = obj.bytes
+                        self.__dict__[other_name] = obj.value
+                    self._raw_values[other_name] = bytes
+                self._offsets[other_name] = (start, self._position)
+            if other_name == name:
+                break
+
+    def _skip(self, field):
+        format = field.get_struct_format()
+        if format is not None:
+            # No need to involve the field, which might check the old data
+            self.read(struct.calcsize(format))
+            return
+        try:
+            field.for_instance(self).read(self)
+        except fields.FullyDecoded:
+            pass
+
+    def _get_offsets(self, name):
+        if name in self._layout.offsets:
+            field, start, end, format = self._layout.offsets[name]
+            return start, end
+        if name not in self._offsets:
+            self._read_through(name)
+        return self._offsets[name]
+
+    def iter_raw_bytes(self):
+        # Fields that haven't been assigned are written out just as they were
+        # read, so nothing needs to be decoded or encoded again
         for name, field in self.__class__._fields.items():
-            value = getattr(self, name)
+            if field.condition is not None and not field.is_present(self):
+                continue
             if name not in self._raw_values:
-                setattr(self, name, getattr(self, name))
-            output += self._raw_values[name]
-        return output
+                try:
+                    self._read_through(name)
+                except IOError:
+                    # There's no data for it, so the default has to be encoded
+                    setattr(self, name, getattr(self, name))
+            value_bytes = self._raw_values[name]
+            if isinstance(value_bytes, fields.Pieces):
+                # Assigned values made of other values are passed along
+                # in pieces, without joining them all together first
+                yield from value_bytes
+            else:
+                yield value_bytes
+
+    def get_raw_bytes(self):
+        return b''.join(self.iter_raw_bytes())
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        with open(path, 'rb') as file:
+            if mmap:
+                buffer = map_file(file)
+            else:
+                buffer = file.read()
+        return cls(buffer)
+
+    @classmethod
+    def get_static_layout(cls):
+        # Some features need to know exactly where every field is
+        if len(cls._layout.fields) != len(cls._fields):
+            raise TypeError('%s must have a static size for every field' % cls.__name__)
+        return cls._layout
+
+    @classmethod
+    def get_compact_fields(cls):
+        static_layout = cls.get_static_layout()
+        compact_fields = collections.OrderedDict()
+        for name, (field, start, end, format) in static_layout.offsets.items():
+            compact_fields[name] = layout.CompactField(field, start, end, format)
+        return static_layout.size, compact_fields
+
+    @classmethod
+    def get_record_type(cls):
+        if '_record_type' not in cls.__dict__:
+            names = [name for name in cls._fields if not name.startswith('_')]
+            record_type = collections.namedtuple(cls.__name__, names)
+            # Records are rebuilt through the structure when unpickled, since
+            # the record type itself can't be found by importing it
+            record_type.__reduce__ = lambda record: (make_record, (cls, tuple(record)))
+            cls._record_type = record_type
+        return cls._record_type
+
+    @classmethod
+    def iter_unpack(cls, buffer):
+        # Decodes consecutive records straight into lightweight tuples,
+        # without creating a structure for each one along the way
+        static_layout = cls.get_static_layout()
+        if '_iter_unpack_records' not in cls.__dict__:
+            cls._iter_unpack_records = {}
+        # Triggers can be added at any time, so there's a separate
+        # function for each set of fields that have them
+        hooked = tuple(name for name, field in cls._fields.items() if layout.has_hooks(field))
+        if hooked not in cls._iter_unpack_records:
+            record_type = cls.get_record_type()
+            names = list(static_layout.offsets)
+            indexes = [names.index(name) for name in record_type._fields]
+            function = static_layout.compile_iter_unpack(record_type, indexes, hooked)
+            cls._iter_unpack_records[hooked] = function
+        return cls._iter_unpack_records[hooked](buffer)
+
+    @classmethod
+    def unpack_many(cls, file, count):
+        size = cls.get_static_layout().size * count
+        if isinstance(file, BUFFER_TYPES):
+            data = BufferReader(file).read(size)
+        else:
+            data = file.read(size)
+        if len(data) < size:
+            raise EOFError('Expected %s bytes, got %s.' % (size, len(data)))
+        return list(cls.iter_unpack(data))
 
     def get_parent(self):
         if isinstance(self._parent, Structure):
             return self._parent
         raise TypeError('%s has no parent' % self.__class__.__name__)
 
+    def patch(self, file, offset=0):
+        # Writes only the fields that have been assigned, at the same spots
+        # they came from, rather than writing out the whole structure again
+        is_buffer = isinstance(file, BUFFER_TYPES)
+        if not is_buffer:
+            position = file.tell()
+        names = [name for name in self._fields if name in self._modified]
+        if self._mode == 'rb':
+            source = self
+        elif is_buffer:
+            # Nothing was read to begin with, so the fields have to be found
+            # in the data that's about to be patched
+            source = type(self)(memoryview(file)[offset:])
+        else:
+            file.seek(offset)
+            source = type(self)(file)
+
+        # Everything gets located before anything is written, so the data
+        # being patched is never read after it's been changed
+        patches = []
+        for name in names:
+            start, end = source._get_offsets(name)
+            data = self._extract(self._fields[name])
+            if len(data) != end - start:
+                raise ValueError('%s was %s bytes, but is now %s, so it must be saved instead of patched'
+                                 % (name, end - start, len(data)))
+            patches.append((offset + start, data))
+
+        for start, data in patches:
+            if is_buffer:
+                file[start:start + len(data)] = data
+            else:
+                file.seek(start)
+                file.write(data)
+        if not is_buffer:
+            file.seek(position)
+        self._modified.clear()
+
     def save(self, file):
-        file.write(self.get_raw_bytes())
+        writer = Writer(file)
+        writer.writelines(self.iter_raw_bytes())
+        writer.flush()
 
     def dump(self, file):
-        file.write(self.dumps())
+        self.save(file)
 
     def dumps(self):
         return self.get_raw_bytes()
@@ -98,6 +374,8 @@ class StructureBase:
     def validate(self):
         errors = []
         for name, field in self._fields.items():
+            if field.condition is not None and not field.is_present(self):
+                continue
             try:
                 field.validate(self, getattr(self, name))
             except ValueError as error:
@@ -111,8 +389,98 @@ class StructureBase:
         return '<%s: %s>' % (type(self).__name__, self)
 
 
-class Structure(StructureBase, metaclass=meta.DeclarativeMetaclass):
-    pass
+def make_record(structure, values):
+    return structure.get_record_type()._make(values)
+
+
+class CompactStructure:
+    """
+    Added to structures declared with compact=True. Rather than keeping
+    track of files, positions and individual values, each instance holds
+    nothing but its raw data, which gets read in full right away. Fields
+    are decoded from that data whenever they're accessed.
+    """
+    __slots__ = ()
+
+    def __init__(self, *files, **kwargs):
+        # Not called args, which would hide the module of the same name
+        if files and kwargs:
+            raise TypeError("Cannot supply a file and attributes together")
+        self._parent = None
+
+        if files:
+            data = files[0]
+            if isinstance(data, BUFFER_TYPES):
+                data = data[:self._compact_size]
+            else:
+                data = data.read(self._compact_size)
+            if len(data) < self._compact_size:
+                raise EOFError('Expected %s bytes, got %s.' % (self._compact_size, len(data)))
+            # A copy of just this record, so it doesn't keep anything else alive
+            self._data = bytes(data)
+            return
+
+        self._data = bytearray(self._compact_size)
+        for name, compact_field in self._compact_fields.items():
+            field = compact_field.field
+            if hasattr(field, 'encoded_value'):
+                compact_field.set_raw_bytes(self, field.encoded_value)
+            elif name not in kwargs and field.default not in (args.NotProvided, None):
+                setattr(self, name, field.default)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def read(self, size=None):
+        raise IOError("not readable")
+
+    def write(self, data):
+        raise IOError("not writable")
+
+    def tell(self):
+        return len(self._data)
+
+    def _extract(self, field):
+        return self._compact_fields[field.name].get_raw_bytes(self)
+
+    def iter_raw_bytes(self):
+        yield bytes(self._data)
+
+    def get_raw_bytes(self):
+        return bytes(self._data)
+
+    def patch(self, file, offset=0):
+        # Changes aren't tracked, but records are small and have a fixed size,
+        # so the whole record can be written right back over the original
+        if isinstance(file, BUFFER_TYPES):
+            file[offset:offset + self._compact_size] = self._data
+        else:
+            position = file.tell()
+            file.seek(offset)
+            file.write(self._data)
+            file.seek(position)
+
+
+class StructureMetaclass(meta.DeclarativeMetaclass):
+    def __new__(cls, name, bases, attrs, compact=False, **options):
+        if any(issubclass(base, CompactStructure) for base in bases):
+            # The slots are already there, from the first compact structure
+            attrs['__slots__'] = ()
+        elif compact:
+            attrs['__slots__'] = ('_data', '_parent')
+            bases = (CompactStructure,) + bases
+        return super(StructureMetaclass, cls).__new__(cls, name, bases, attrs, **options)
+
+    def __init__(cls, name, bases, attrs, compact=False, **options):
+        super(StructureMetaclass, cls).__init__(name, bases, attrs, **options)
+        if issubclass(cls, CompactStructure):
+            # Fields get replaced with versions that work on the raw data
+            cls._compact_size, cls._compact_fields = cls.get_compact_fields()
+            for name, compact_field in cls._compact_fields.items():
+                setattr(cls, name, compact_field)
+
+
+class Structure(StructureBase, metaclass=StructureMetaclass):
+    __slots__ = ()
 
 
 class EOFBytesIO(io.BytesIO):
@@ -127,6 +495,237 @@ class EOFBytesIO(io.BytesIO):
         return data
 
 
+class BufferReader:
+    """
+    A read-only file-like object that works directly on bytes, bytearrays,
+    memoryviews and mmaps. Reads return memoryview slices of the original
+    buffer, so nothing gets copied until bytes are actually needed.
+    """
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if view.ndim != 1 or view.format != 'B':
+            view = view.cast('B')
+        self.buffer = view
+        self.position = 0
+
+    def read(self, size=None):
+        start = self.position
+        if size is None or size < 0:
+            end = len(self.buffer)
+        else:
+            end = min(start + size, len(self.buffer))
+        self.position = end
+        return self.buffer[start:end]
+
+    def peek(self, size=1):
+        return self.buffer[self.position:self.position + size]
+
+    def find(self, terminator):
+        # Where the terminator starts, relative to the current position
+        index = find(self.buffer, terminator, self.position)
+        if index < 0:
+            return index
+        return index - self.position
+
+    def readuntil(self, terminator):
+        index = self.find(terminator)
+        if index < 0:
+            return self.read()
+        return self.read(index + len(terminator))
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        if offset < 0:
+            raise ValueError("negative seek position %r" % offset)
+        self.position = offset
+        return offset
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+
+class EOFBufferReader(BufferReader):
+    """
+    A BufferReader that raises an EOFError if more data was requested than
+    is available, rather than quietly returning less.
+    """
+    def read(self, size=None):
+        data = super(EOFBufferReader, self).read(size)
+        if size is not None and size >= 0 and len(data) < size:
+            raise EOFError
+        return data
+
+    def readuntil(self, terminator):
+        # More data might still be on its way, so a missing terminator
+        # means waiting for it, rather than reading everything left
+        index = self.find(terminator)
+        if index < 0:
+            raise EOFError
+        return self.read(index + len(terminator))
+
+
+class Writer:
+    """
+    Collects encoded pieces of data and passes them along to a file in
+    batches, so that a structure never has to be assembled into a single
+    byte string just to be written out.
+    """
+    def __init__(self, file, batch_size=1024):
+        self.file = file
+        self.batch_size = batch_size
+        self.pieces = []
+
+    def write(self, data):
+        self.pieces.append(data)
+        if len(self.pieces) >= self.batch_size:
+            self.flush()
+
+    def writelines(self, pieces):
+        for data in pieces:
+            self.write(data)
+
+    def flush(self):
+        if not self.pieces:
+            return
+        if hasattr(self.file, 'writelines'):
+            self.file.writelines(self.pieces)
+        else:
+            for data in self.pieces:
+                self.file.write(data)
+        self.pieces = []
+
+
+def map_file(file):
+    # Maps the file into memory read-only, so that the OS page cache backs
+    # all the data, rather than copies of it. The mapping stays valid after
+    # the file is closed and goes away once nothing refers to it anymore.
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped, but there's nothing to copy anyway
+        return file.read()
+
+
+def detach(value, parent):
+    # Copies anything a value refers to in data that's about to be discarded
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, list):
+        return type(value)(detach(item, parent) for item in value)
+    if type(value).__init__ is StructureBase.__init__:
+        # Structures are parsed again from their own data, only once used
+        copy = type(value)(value.get_raw_bytes())
+        copy._parent = parent
+        return copy
+    return value
+
+
+def get_terminator(field):
+    # Fields that read up to a terminator can't be finished until it arrives
+    if getattr(field, 'size', None) is None:
+        return getattr(field, 'terminator', None)
+    return None
+
+
+def get_needed_size(field, available):
+    # How much data a field needs in order to be read, if that can be known
+    # ahead of time. Otherwise, it has to be tried again with more data.
+    format = field.get_struct_format()
+    if format is not None:
+        return struct.calcsize(format)
+    return available + 1
+
+
+def find(buffer, terminator, start=0):
+    # Like bytes.find(), but for any buffer, including memoryviews, which
+    # don't have a find() of their own. Rather than copying everything
+    # after the start, each search covers twice as much as the last,
+    # starting over just far enough back to catch a split terminator.
+    size = FIND_SIZE
+    offset = start
+    while True:
+        end = min(offset + size, len(buffer))
+        index = bytes(buffer[offset:end]).find(terminator)
+        if index >= 0:
+            return offset + index
+        if end >= len(buffer):
+            return -1
+        offset = max(end - len(terminator) + 1, offset)
+        size *= 2
+
+
+def peek(file, size=1):
+    # Looks at upcoming data without reading it, as long as the file has
+    # some way to do that. Otherwise, there's nothing to see.
+    if hasattr(file, 'peek'):
+        return file.peek(size)[:size]
+    if getattr(file, 'seekable', lambda: False)():
+        position = file.tell()
+        data = file.read(size)
+        file.seek(position)
+        return data
+    return b''
+
+
+def read_until(file, terminator):
+    # Reads up to and including the terminator, or to the end of the file,
+    # using the file's own buffer to find it wherever possible
+    if hasattr(file, 'readuntil'):
+        return file.readuntil(terminator)
+
+    value = bytearray()
+    buffered = hasattr(file, 'peek')
+    if buffered or getattr(file, 'seekable', lambda: False)():
+        # Look ahead a piece at a time, then only consume as much as the
+        # value actually needs, either from the file's buffer or by
+        # seeking back to the end of the terminator
+        size = FIND_SIZE
+        while True:
+            data = file.peek(size) if buffered else file.read(size)
+            if not data:
+                return bytes(value)
+            start = max(len(value) - len(terminator) + 1, 0)
+            value += data
+            index = value.find(terminator, start)
+            if index >= 0:
+                extra = len(value) - index - len(terminator)
+                if buffered:
+                    file.read(len(data) - extra)
+                elif extra:
+                    file.seek(-extra, io.SEEK_CUR)
+                del value[len(value) - extra:]
+                return bytes(value)
+            if buffered:
+                file.read(len(data))
+            else:
+                size *= 2
+
+    # Otherwise, one byte at a time is all that can be done safely
+    while True:
+        data = file.read(1)
+        value += data
+        if not data or value.endswith(terminator):
+            return bytes(value)
+
+
+def get_buffer_reader(file):
+    # Finds the BufferReader behind a file or structure, if there is one
+    while isinstance(file, StructureBase):
+        file = file._file
+    if isinstance(file, BufferReader):
+        return file
+    return None
+
+
 class StructureStreamer:
     def __init__(self, structure):
         self.structure = structure
@@ -137,7 +736,13 @@ class StructureStreamer:
             try:
                 value = self.structure(file)
                 for name, field in self.structure._fields.items():
+                    if field.condition is not None and not field.is_present(value):
+                        continue
                     getattr(value, name)
+                if file.tell() == position:
+                    # Short reads don't always raise, so a record that
+                    # consumed nothing means the file is exhausted
+                    break
             except Exception as e:
                 if file.tell() == position:
                     # The file didn't move, so it must be at the end
@@ -146,6 +751,178 @@ class StructureStreamer:
                 raise e
             yield value
 
+    def find_offsets(self, buffer):
+        # Where each record in the buffer starts, followed by where the last
+        # one ends, which requires parsing each record to find its size
+        offsets, key_values = self.scan(buffer)
+        return offsets
+
+    def scan(self, buffer, keys=()):
+        reader = EOFBufferReader(buffer)
+        offsets = array.array('Q', [0])
+        key_values = [array.array('Q') for key in keys]
+        # Reading the raw bytes for the last field reads everything before
+        # it too, but only decodes the fields that other sizes depend on
+        last_field = list(self.structure._fields.values())[-1]
+        while reader.tell() < len(reader.buffer):
+            value = self.structure(reader)
+            value._extract(last_field)
+            offsets.append(reader.tell())
+            for key, values in zip(keys, key_values):
+                values.append(getattr(value, key))
+        return offsets, key_values
+
+    def build_index(self, file, keys=(), index_path=None):
+        """
+        Writes the offset of every record in the file to a separate index
+        file, along with the values of any key fields, which must all be
+        non-negative integers. Returns the path to the index.
+        """
+        path = get_path(file)
+        index_path = index_path or path + '.index'
+        with open(path, 'rb') as data_file:
+            # Checked before reading anything, so any changes made
+            # while the file is being scanned make the index stale
+            stat = os.fstat(data_file.fileno())
+            buffer = map_file(data_file)
+        offsets, key_values = self.scan(buffer, keys)
+
+        names = b''.join(key.encode('utf-8') + b'\x00' for key in keys)
+        # Pad the names so that all the values line up on 8-byte boundaries
+        names += b'\x00' * (-(INDEX_HEADER.size + len(names)) % 8)
+
+        temp_path = '%s.%s.tmp' % (index_path, os.getpid())
+        with open(temp_path, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_SIGNATURE, *get_signature(stat),
+                                               len(offsets) - 1, len(keys)))
+            index_file.write(names)
+            for values in [offsets] + key_values:
+                if sys.byteorder == 'big':
+                    values = array.array('Q', values)
+                    values.byteswap()
+                values.tofile(index_file)
+        os.replace(temp_path, index_path)
+        return index_path
+
+    def open_indexed(self, file, keys=(), index_path=None):
+        """
+        Opens a file for random access to its records, using the index made
+        by build_index(). If there's no index yet, or the file has changed
+        size since it was made, a new one gets built first.
+        """
+        path = get_path(file)
+        index_path = index_path or path + '.index'
+        with open(path, 'rb') as data_file:
+            stat = os.fstat(data_file.fileno())
+            buffer = map_file(data_file)
+        index = load_index(index_path, stat)
+        if index is None or not set(keys) <= set(index[1]):
+            # Keys that were indexed before are kept, so that looking them
+            # up again doesn't mean building yet another index
+            keys = [key for key in get_index_keys(index_path) if key in self.structure._fields] + list(keys)
+            keys = list(collections.OrderedDict.fromkeys(keys))
+            self.build_index(path, keys, index_path)
+            index = load_index(index_path, stat)
+        offsets, key_values = index
+        return IndexedStream(self.structure, buffer, offsets, key_values)
+
+
+class IndexedStream:
+    """
+    Random access to the records in a file, by their position in the file.
+    Records are only parsed when they're requested, and each one only reads
+    its own data. Values of any indexed key fields are available as arrays,
+    in the same order as the records, so they can be searched directly.
+    """
+    def __init__(self, structure, buffer, offsets, keys):
+        self.structure = structure
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.offsets = offsets
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        return self.structure(self.view[self.offsets[index]:self.offsets[index + 1]])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def get_signature(stat):
+    # Enough to tell whether a file has changed since it was indexed
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def load_index(index_path, stat):
+    # Returns the offsets and key values from an index, or None if it's
+    # missing, damaged or doesn't match the data it's supposed to index
+    try:
+        with open(index_path, 'rb') as index_file:
+            index = map_file(index_file)
+        signature, size, mtime, inode, count, key_count = INDEX_HEADER.unpack_from(index)
+    except (OSError, struct.error):
+        return None
+    if signature != INDEX_SIGNATURE or (size, mtime, inode) != get_signature(stat):
+        return None
+
+    names, position = read_index_keys(index, key_count)
+    arrays = []
+    for length in [count + 1] + [count] * key_count:
+        data = memoryview(index)[position:position + length * 8]
+        if len(data) < length * 8:
+            return None
+        if sys.byteorder == 'little':
+            # The values can be used right out of the mapped file
+            arrays.append(data.cast('Q'))
+        else:
+            values = array.array('Q')
+            values.frombytes(data)
+            values.byteswap()
+            arrays.append(values)
+        position += length * 8
+    return arrays[0], dict(zip(names, arrays[1:]))
+
+
+def get_index_keys(index_path):
+    # The key fields in an existing index, even if it's out of date
+    try:
+        with open(index_path, 'rb') as index_file:
+            index = map_file(index_file)
+        signature, size, mtime, inode, count, key_count = INDEX_HEADER.unpack_from(index)
+        if signature != INDEX_SIGNATURE:
+            return []
+        return read_index_keys(index, key_count)[0]
+    except (OSError, struct.error, UnicodeDecodeError):
+        return []
+
+
+def read_index_keys(index, key_count):
+    # Returns the names of the key fields, along with where the values start
+    position = INDEX_HEADER.size
+    names = []
+    for i in range(key_count):
+        end = index.find(b'\x00', position)
+        names.append(bytes(index[position:end]).decode('utf-8'))
+        position = end + 1
+    position += -position % 8
+    return names, position
+
+
+def get_path(file):
+    if hasattr(file, 'name') and not isinstance(file, (str, bytes)):
+        return file.name
+    return os.fspath(file)
+
 
 class StructureTupleMetaclass(meta.DeclarativeMetaclass):
     def __init__(cls, name, bases, attrs, **options):
@@ -2,7 +2,7 @@ import io
 
 from steel.common import meta, args, fields
 from steel.fields import Field
-from steel.base import Structure
+from steel.base import Structure, BufferReader, Writer, get_buffer_reader
 from steel.fields.strings import Bytes
 
 __all__ = ['Chunk', 'Payload', 'ChunkList', 'ChunkStreamer']
@@ -29,13 +29,21 @@ class Chunk(metaclass=ChunkMetaclass):
 
     @classmethod
     def read(cls, file):
+        reader = get_buffer_reader(file)
+        if reader is not None:
+            start = reader.tell()
+
         value = cls.structure(file)
         # Force the evaluation of the entire structure in
         # order to make sure other fields work properly
-        value_bytes = b''
         for name in cls.structure._fields:
             getattr(value, name)
-            value_bytes += value._raw_values[name]
+
+        if reader is not None:
+            # Refer to the chunk's spot in the buffer rather than copying it
+            value_bytes = reader.buffer[start:reader.tell()]
+        else:
+            value_bytes = b''.join(value._raw_values[name] for name in cls.structure._fields)
 
         return value_bytes, value
 
@@ -44,6 +52,9 @@ class Chunk(metaclass=ChunkMetaclass):
 
 
 class ChunkMixin:
+    # No attributes of its own, so it can be mixed into existing structures
+    __slots__ = ()
+
     def __init__(self, *args, process_chunk=True, **kwargs):
         if process_chunk and not args:
             process_chunk = False
@@ -60,18 +71,31 @@ class ChunkMixin:
         else:
             super(ChunkMixin, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def get_static_layout(cls):
+        # The fields only describe the payload, not the chunk wrapped around it
+        raise TypeError('%s is read as a chunk, which has no static size' % cls.__name__)
+
     def save(self, file):
-        payload = io.BytesIO()
-        super(ChunkMixin, self).save(payload)
+        writer = Writer(file)
+        writer.writelines(self.iter_chunk_bytes())
+        writer.flush()
+
+    def iter_chunk_bytes(self):
+        # The payload's size has to be known before it's written, so it gets
+        # joined together, but the chunk around it is passed along in pieces
         chunk = self._chunk.structure(id=self._chunk.id)
-        chunk.payload = payload.getvalue()
+        chunk.payload = b''.join(super(ChunkMixin, self).iter_raw_bytes())
         chunk.size = len(chunk.payload)
-        chunk.save(file)
+        return chunk.iter_raw_bytes()
 
 
 class Payload(Bytes):
     def read(self, file):
         value_bytes = super(Payload, self).read(file)
+        if isinstance(value_bytes, memoryview):
+            # Keep working from the original buffer rather than a copy
+            raise fields.FullyDecoded(value_bytes, BufferReader(value_bytes))
         raise fields.FullyDecoded(value_bytes, io.BytesIO(value_bytes))
 
 
@@ -85,11 +109,16 @@ class ChunkList(Field):
         super(ChunkList, self).__init__()
 
     def read(self, file):
-        chunks_bytes = b''
+        reader = get_buffer_reader(file)
+        if reader is not None:
+            start = reader.tell()
+
+        chunks_bytes = []
         chunks = ChunkValueList()
         while 1:
             chunk_bytes, chunk = self.base_chunk.read(file)
-            chunks_bytes += chunk_bytes
+            if reader is None:
+                chunks_bytes.append(chunk_bytes)
             if chunk.id in self.known_types:
                 value = self.known_types[chunk.id](chunk.payload, process_chunk=False)
                 if self.terminator and isinstance(chunk, self.terminator):
@@ -101,18 +130,24 @@ class ChunkList(Field):
             else:
                 # This is not a valid chunk, which is probably the end of the file
                 break
+
+        if reader is not None:
+            chunks_bytes = reader.buffer[start:reader.tell()]
+        else:
+            chunks_bytes = b''.join(chunks_bytes)
         raise fields.FullyDecoded(chunks_bytes, chunks)
 
     def encode(self, chunks):
-        output = io.BytesIO()
+        return b''.join(self.iter_encode(chunks))
+
+    def iter_encode(self, chunks):
         for chunk in chunks:
             if not isinstance(chunk, tuple(self.known_types.values())):
                 raise TypeError("Unknown chunk type %r" % chunk._chunk.id)
-            chunk.save(output)
+            yield from chunk.iter_chunk_bytes()
         if self.terminator and not isinstance(chunk, self.terminator):
             # The last chunk wasn't a terminator, so add one automatically
-            self.terminator().save(output)
-        return output.getvalue()
+            yield from self.terminator().iter_chunk_bytes()
 
 
 class ChunkValueList(list):
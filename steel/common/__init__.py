@@ -1,11 +1,9 @@
-import collections
 import threading
 
 # Temporary storage
 data = threading.local()
 data.field_options = {}
 data.field_stack = [[]]
-data.instance_stack = collections.defaultdict(list)
 
 from steel.common.meta import *
 from steel.common.fields import *
@@ -1,7 +1,5 @@
 import copy
 
-from steel.common import data
-
 NotProvided = object()
 
 class Argument:
@@ -57,13 +55,13 @@ class Argument:
             value = instance.__dict__[arg.name]
         except KeyError:
             raise AttributeError(self.name)
-        key = hash(instance)
-        if data.instance_stack[key]:
-            instance = data.instance_stack[key][-1]
+        # Fields bound to an instance resolve their arguments against it
+        bound_instance = instance.__dict__.get('instance')
+        if bound_instance is not None:
             if arg.resolve_field and hasattr(value, 'resolve'):
-                value = value.resolve(instance)
+                value = value.resolve(bound_instance)
             elif hasattr(value, '__call__'):
-                value = value(instance)
+                value = value(bound_instance)
         return value
 
     def __set__(self, instance, value):
@@ -0,0 +1,74 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import types
+
+__all__ = ['compile_function']
+
+# Compiling generated code is one of the slower parts of creating a class,
+# so compiled code can also be cached on disk, for processes that would
+# otherwise have to do it all over again every time they start up.
+CACHE_DIR = os.environ.get('STEEL_CACHE_DIR')
+
+# Code that's already been compiled in this process, by its source
+code_cache = {}
+
+
+def compile_function(name, lines, namespace):
+    """
+    Builds a function out of generated lines of source code. Anything the
+    code refers to besides its arguments must be supplied in the namespace,
+    which is used as the function's globals.
+    """
+    source = '\n'.join(lines) + '\n'
+    namespace = dict(namespace)
+    exec(get_code(name, source), namespace)
+    return namespace[name]
+
+
+def get_code(name, source):
+    key = (name, source)
+    if key not in code_cache:
+        if CACHE_DIR:
+            code_cache[key] = load_code(name, source, CACHE_DIR)
+        else:
+            code_cache[key] = compile(source, '<steel: %s>' % name, 'exec')
+    return code_cache[key]
+
+
+def load_code(name, source, cache_dir):
+    # Compiled code is only valid for the version of Python that made it,
+    # so that's part of the key, along with everything that was compiled
+    digest = hashlib.sha1(importlib.util.MAGIC_NUMBER)
+    digest.update(('%s\n%s' % (name, source)).encode('utf-8'))
+    path = os.path.join(cache_dir, '%s.code' % digest.hexdigest())
+
+    # Anything missing, unreadable or corrupt just gets compiled again
+    try:
+        with open(path, 'rb') as file:
+            code = marshal.load(file)
+        if isinstance(code, types.CodeType):
+            return code
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    code = compile(source, '<steel: %s>' % name, 'exec')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Other processes may be doing the same thing at the same time, so
+        # only put the file in place once it's been completely written
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as file:
+            marshal.dump(code, file)
+        os.replace(temp_path, path)
+    except OSError:
+        # The cache is only an optimization, so it's fine if it can't be used
+        pass
+    return code
+
+
+def unpack_targets(count):
+    # Names for each value unpacked by struct, in a form that can be
+    # assigned to directly, even when there's only one of them
+    return ''.join('v%s, ' % i for i in range(count))
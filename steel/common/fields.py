@@ -1,46 +1,69 @@
-import copy
 import functools
 import io
+import struct
 import sys
+import weakref
 
-from steel.common import args, meta, data
+from steel.common import args, codegen, meta, data
 
-__all__ = ['Field', 'FullyDecoded', 'Condition']
+__all__ = ['Field', 'FullyDecoded', 'Incomplete', 'Condition']
 
 
 class Trigger:
+    """
+    Functions to call when something happens to a field's value. Functions
+    added to the trigger on the class apply to every field, while each field
+    can also add more of its own. Each field keeps track of its own, so they
+    only last as long as the field itself.
+    """
     def __init__(self):
-        self.cache = {}
-        self.functions = set()
+        self.functions = ()
+
+    def set_name(self, name):
+        self.name = name
+        self.key = '_%s_trigger' % name
 
     def __call__(self, func):
         # Used as a decorator
-        self.functions.add(func)
+        self.functions += (func,)
+        return func
 
     def __get__(self, instance, owner):
-        if owner is None:
+        if instance is None:
             return self
-        if instance not in self.cache:
-            self.cache[instance] = BoundTrigger(instance, self.functions)
-        return self.cache[instance]
+        bound = instance.__dict__.get(self.key)
+        if bound is None or bound.field() is not instance:
+            # Copies of a field start out with nothing but the class's functions
+            bound = BoundTrigger(instance, self)
+            instance.__dict__[self.key] = bound
+        return bound
 
 
 class BoundTrigger:
-    def __init__(self, field, functions):
-        self.field = field
-        self.functions = set(functools.partial(func, field) for func in functions)
+    def __init__(self, field, trigger):
+        # The field already holds onto this, so it mustn't hold onto the field
+        self.field = weakref.ref(field)
+        self.trigger = trigger
+        self.functions = ()
 
     def __iter__(self):
-        return iter(self.functions)
+        field = self.field()
+        for func in self.trigger.functions:
+            yield functools.partial(func, field)
+        yield from self.functions
 
     def __call__(self, func):
         # Used as a decorator
-        self.functions.add(func)
+        self.functions += (func,)
+        return func
 
-    def apply(self, *args, **kwargs):
+    def apply(self, instance, value):
         # Called from within the appropriate code
+        field = self.field()
+        for func in self.trigger.functions:
+            func(field, instance, value)
         for func in self.functions:
-            func(*args, **kwargs)
+            func(instance, value)
 
 
 class Field(metaclass=meta.DeclarativeFieldMetaclass):
@@ -52,6 +75,14 @@ class Field(metaclass=meta.DeclarativeFieldMetaclass):
     after_encode = Trigger()
     after_decode = Trigger()
 
+    # Whether values unpacked using a struct format code other than raw
+    # bytes are already decoded, so they can be used without unpack()
+    struct_decoded = False
+
+    # The condition a field was declared under, if any, which decides
+    # whether the field is present in any given structure
+    condition = None
+
     def getter(self, func):
         # For compatibility with typical property usage
         self._getters.append(func)
@@ -113,6 +144,36 @@ class Field(metaclass=meta.DeclarativeFieldMetaclass):
         # fields can/should override it if necessary
         obj.write(value)
 
+    def get_min_size(self):
+        # The fewest bytes a value could take up, so that reading several
+        # of them can tell how much more data to wait for
+        format = self.get_struct_format()
+        if format is not None:
+            return struct.calcsize(format)
+        return 0
+
+    def iter_encode(self, value):
+        # Encodes a value in pieces, to be written out one after another.
+        # Fields made up of other values can override this, so that saving
+        # them never has to join everything together first.
+        yield self.encode(value)
+
+    def get_struct_format(self):
+        # Fields that always read the same number of bytes can supply a
+        # struct format code, so they can be read along with their neighbors
+        return None
+
+    def decode_many(self, value, size):
+        # Decodes a run of values that each take up the same number of
+        # bytes. Fields that can decode them all at once can override this.
+        return [self.decode(value[i:i + size]) for i in range(0, len(value), size)]
+
+    def unpack(self, value):
+        # Converts a value unpacked by struct into a native value, if the
+        # format code was enough to decode it. Otherwise, the raw bytes
+        # will be decoded as usual when the attribute is accessed.
+        return args.NotProvided
+
     def set_name(self, name):
         self.name = name
         label = self.label or name.replace('_', ' ')
@@ -124,20 +185,20 @@ class Field(metaclass=meta.DeclarativeFieldMetaclass):
     def validate(self, obj, value):
         # This should raise a ValueError if the value is invalid
         # It should simply return without an error if it's valid
-        with self.for_instance(obj):
-            # First, make sure the value can be encoded
-            self.encode(value)
-    
-            # Then make sure it's a valid option, if applicable
-            if self.choices and value not in set(v for v, desc in self.choices):
-                raise ValueError("%r is not a valid choice" % value)
+        field = self.for_instance(obj)
+
+        # First, make sure the value can be encoded
+        field.encode(value)
+
+        # Then make sure it's a valid option, if applicable
+        if field.choices and value not in set(v for v, desc in field.choices):
+            raise ValueError("%r is not a valid choice" % value)
 
     def _extract(self, instance):
-        with self.for_instance(instance):
-            try:
-                return self.read(instance), None
-            except FullyDecoded as obj:
-                return obj.bytes, obj.value
+        try:
+            return self.for_instance(instance).read(instance), None
+        except FullyDecoded as obj:
+            return obj.bytes, obj.value
 
     def read_value(self, file):
         try:
@@ -147,40 +208,94 @@ class Field(metaclass=meta.DeclarativeFieldMetaclass):
         except FullyDecoded as obj:
             return obj.bytes, obj.value
 
+    def read_many(self, file, count):
+        # Reads the given number of values one after another, or all of the
+        # values left in the file if the count is -1. Fields that can find
+        # where their values end without reading each one separately can
+        # override this to do them all at once.
+        value_bytes = []
+        values = []
+        while count < 0 or len(values) < count:
+            try:
+                bytes, value = self.read_value(file)
+            except EOFError:
+                if count < 0:
+                    raise
+                # Every value that's left needs at least a little more data
+                consumed = sum(len(bytes) for bytes in value_bytes)
+                raise Incomplete(consumed + (count - len(values)) * self.get_min_size())
+            if count < 0 and not bytes:
+                break
+            value_bytes.append(bytes)
+            values.append(value)
+        return b''.join(value_bytes), values
+
+    def is_present(self, instance):
+        return self.condition is None or getattr(instance, self.condition.name)
+
     def for_instance(self, instance):
-        return meta.AttributeInstance(self, instance)
+        # A copy of the field whose arguments get resolved using the given
+        # instance, so that fields can refer to each other's values
+        if instance is None:
+            return self
+        field = object.__new__(type(self))
+        field.__dict__.update(self.__dict__)
+        field.instance = instance
+        return field
 
     def __get__(self, instance, owner):
         if not instance:
             return self
 
+        # Values that have already been decoded are simply handed back
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            pass
+
+        if self.condition is not None and not self.is_present(instance):
+            raise AttributeError("Attribute %r is not present" % self.name)
+
         # Customizes the field for this particular instance
         # Use field instead of self for the rest of the method
-        with self.for_instance(instance):
-            try:
-                value = instance._extract(self)
-            except IOError:
-                if self.default is not args.NotProvided:
-                    return self.default
-                raise AttributeError("Attribute %r has no data" % self.name)
-    
-            if self.name not in instance.__dict__:
-                value = self.decode(value)
-                self.after_decode.apply(instance, value)
-
-                for getter in self._getters:
-                    value = getter(instance, value)
-
-                instance.__dict__[self.name] = value
-            return instance.__dict__[self.name]
+        field = self.for_instance(instance)
+        try:
+            value = instance._extract(self)
+        except IOError:
+            if field.default is not args.NotProvided:
+                return field.default
+            raise AttributeError("Attribute %r has no data" % self.name)
+
+        if self.name not in instance.__dict__:
+            value = field.decode(value)
+            self.after_decode.apply(instance, value)
+
+            for getter in self._getters:
+                value = getter(instance, value)
+
+            instance.__dict__[self.name] = value
+        return instance.__dict__[self.name]
 
     def __set__(self, instance, value):
         for setter in self._setters:
             value = setter(instance, value)
 
-        with self.for_instance(instance):
-            instance.__dict__[self.name] = value
-            instance._raw_values[self.name] = self.encode(value)
+        instance._modified.add(self.name)
+        if instance._mode == 'rb' and self.name not in instance._offsets:
+            # Find where the original value was before replacing it, since
+            # its size might depend on other values that are about to change
+            instance._get_offsets(self.name)
+
+        instance.__dict__[self.name] = value
+        field = self.for_instance(instance)
+        if type(field).iter_encode is Field.iter_encode:
+            instance._raw_values[self.name] = field.encode(value)
+        else:
+            # Encoded right away, so later changes to the value don't get
+            # out of step with other fields, but the pieces aren't joined
+            # together unless something needs all of the bytes at once
+            instance._raw_values[self.name] = Pieces(field.iter_encode(value))
+        instance._calculated.clear()
         self.after_encode.apply(instance, value)
 
     def __repr__(self):
@@ -190,10 +305,10 @@ class Field(metaclass=meta.DeclarativeFieldMetaclass):
         return id(self)
 
     def __eq__(self, other):
-        return Condition(self, other, lambda a, b: a == b)
+        return Condition(self, other, '==')
 
     def __ne__(self, other):
-        return Condition(self, other, lambda a, b: a != b)
+        return Condition(self, other, '!=')
 
 
 class FullyDecoded(Exception):
@@ -202,11 +317,41 @@ class FullyDecoded(Exception):
         self.value = value
 
 
+class Incomplete(EOFError):
+    """
+    Raised when the data runs out partway through a value, along with the
+    fewest bytes the whole value could take up, from where it started, so
+    that incoming data doesn't need to be parsed again until then.
+    """
+    def __init__(self, needed):
+        super(Incomplete, self).__init__()
+        self.needed = needed
+
+
+class Pieces(list):
+    """
+    Stands in for the raw bytes of an assigned value that was encoded in
+    pieces, so they can be written out one after another, and only get
+    joined together if something needs all of the bytes at once.
+    """
+    def get_bytes(self):
+        return b''.join(self)
+
+
 class Condition:
-    def __init__(self, a, b, compare):
+    """
+    Declared using a `with` block around any fields that should only be
+    present when a comparison is true. The fields themselves become part of
+    the structure like any other, so the condition is only checked once,
+    at the point in the data where those fields would start.
+    """
+    # Conditions can be nested inside of other conditions
+    condition = None
+
+    def __init__(self, a, b, operator):
         self.a = a
         self.b = b
-        self.compare = compare
+        self.operator = operator
 
     def __enter__(self):
         # Hack to add the condition to the class without
@@ -243,54 +388,67 @@ class Condition:
 
     def attach_to_class(self, cls):
         cls._fields[self.name] = self
+        self.evaluate = self.compile_evaluate()
+
+        # The fields inside the block follow right after the condition
+        for field in self.fields:
+            if field.name in cls._fields:
+                raise TypeError('%r is declared more than once; use a Switch to choose between alternatives' % field.name)
+            field.condition = self
+            field.attach_to_class(cls)
+            setattr(cls, field.name, field)
+
+    def compile_evaluate(self):
+        # Builds a function that resolves both sides of the comparison
+        # against an instance, with anything static written right into it
+        namespace = {}
+        operands = []
+        for i, operand in enumerate((self.a, self.b)):
+            if hasattr(operand, 'resolve'):
+                namespace['resolve_%d' % i] = operand.resolve
+                operands.append('resolve_%d(instance)' % i)
+            else:
+                namespace['value_%d' % i] = operand
+                operands.append('value_%d' % i)
+        expression = '%s %s %s' % (operands[0], self.operator, operands[1])
+        if self.condition is not None:
+            # Only worth checking if the outer condition was met
+            expression = 'getattr(instance, %r) and %s' % (self.condition.name, expression)
+        lines = [
+            'def evaluate(instance):',
+            '    return bool(%s)' % expression,
+        ]
+        return codegen.compile_function('evaluate', lines, namespace)
+
+    def is_present(self, instance):
+        return self.condition is None or getattr(instance, self.condition.name)
 
     def for_instance(self, instance):
+        # Bound the same way as fields, so it can be read along with them
         if instance is None:
             return self
-        field = copy.copy(self)
-        if hasattr(field.a, 'for_instance'):
-            field.a = field.a.for_instance(instance)
-        if hasattr(field.b, 'for_instance'):
-            field.b = field.b.for_instance(instance)
-        return field
+        condition = object.__new__(type(self))
+        condition.__dict__.update(self.__dict__)
+        condition.instance = instance
+        return condition
+
+    def read(self, file):
+        # Takes up no space of its own, but the result is kept with the rest
+        # of the values, so the fields inside can check it as they're read
+        raise FullyDecoded(b'', self.evaluate(self.instance))
+
+    def validate(self, obj, value):
+        pass
 
     def __get__(self, instance, owner):
         if not instance:
             return self
-        
-        if self.name in instance.__dict__:
-            # This condition has already been processed, so don't try getting it again
-            return None
-
-        # Customizes the field for this particular instance
-        # Use field instead of self for the rest of the method
-        with self.for_instance(instance):
-
-            a = self.a
-            if hasattr(a, 'resolve'):
-                a = a.resolve(instance)
-
-            b = self.b
-            if hasattr(b, 'resolve'):
-                b = b.resolve(instance)
-
-            if self.compare(a, b):
-                # The comparison succeeded, so the fields should be processed
-
-                raw_bytes = b''
-                for f in self.fields:
-                    with f.for_instance(instance):
-                        bytes, value = f.read_value(instance)
-                        raw_bytes += bytes
-                        instance.__dict__[f.name] = value
-                        f.after_decode.apply(instance, value)
-                instance._raw_values[self.name] = raw_bytes
-
-        return None
 
+        if self.name not in instance.__dict__:
+            instance.__dict__[self.name] = self.evaluate(instance)
+        return instance.__dict__[self.name]
 
     def __set__(self, instance, value):
         instance.__dict__[self.name] = value
         instance._raw_values[self.name] = b''
-
-
+        instance._calculated.clear()
@@ -0,0 +1,274 @@
+import struct
+
+from steel.common import args, codegen
+
+__all__ = ['Layout', 'CompactField']
+
+
+class Layout:
+    """
+    A plan for reading a run of fields whose sizes are all known as soon as
+    the class is created. Rather than reading and decoding each field on its
+    own, the whole run is read at once and split apart using a single,
+    precompiled struct format.
+    """
+
+    def __init__(self, fields):
+        self.fields = []
+        byteorder = None
+        codes = []
+        offset = 0
+        for field, format in fields:
+            if format[0] in '<>':
+                if byteorder is None:
+                    byteorder = format[0]
+                elif format[0] != byteorder:
+                    # A struct format only supports one byte order, so
+                    # anything else gets decoded from its raw bytes instead
+                    format = '%ds' % struct.calcsize(format)
+            code = format.lstrip('<>')
+            size = struct.calcsize('>' + code)
+            codes.append(code)
+            self.fields.append((field.name, field, offset, offset + size))
+            offset += size
+
+        self.format = (byteorder or '>') + ''.join(codes)
+        self.struct = struct.Struct(self.format)
+        self.size = self.struct.size
+
+        # Offsets of each field, so they can be accessed directly if the
+        # source allows it, without reading the rest of the run
+        self.offsets = {}
+        self.checks = []
+        self.decoded = []
+        for (name, field, start, end), code in zip(self.fields, codes):
+            self.offsets[name] = (field, start, end, struct.Struct(self.format[0] + code))
+            if getattr(field, 'always_read', False):
+                self.checks.append(name)
+            # Some values come out of struct already in their final form
+            self.decoded.append(getattr(field, 'struct_decoded', False) and not code.endswith('s'))
+
+    @classmethod
+    def leading(cls, fields):
+        # Collect fields until one comes along whose size isn't static
+        static = []
+        for field in fields:
+            format = get_struct_format(field)
+            if format is None:
+                break
+            static.append((field, format))
+        return cls(static)
+
+    @classmethod
+    def runs(cls, fields):
+        # Every other run of static fields after the leading one, keyed by
+        # the name of the field it starts with. These can't be placed ahead
+        # of time, but each one can still be read all at once once it's
+        # reached. Fields that might not be present break up a run, since
+        # their sizes aren't known until their conditions are checked.
+        runs = {}
+        static = []
+        leading = True
+        for field in list(fields) + [None]:
+            format = field is not None and get_struct_format(field)
+            if format and field.condition is None:
+                static.append((field, format))
+                continue
+            if not leading and len(static) > 1:
+                # A single field gains nothing from being read as a run
+                runs[static[0][0].name] = cls(static)
+            static = []
+            leading = False
+        return runs
+
+    def unpack(self, instance):
+        if self.fields:
+            # Replaces the generic method with one built for these fields,
+            # but only once it's needed, rather than for every class
+            self.unpack = self.compile_unpack()
+            return self.unpack(instance)
+        self.unpack_data(instance, instance.read(self.size))
+
+    def unpack_data(self, instance, data):
+        raw_values = instance._raw_values
+        if len(data) < self.size:
+            # There's not enough data for the whole run, so just hand out
+            # whatever is there, the same way individual reads would have
+            for name, field, start, end in self.fields:
+                raw_values.setdefault(name, data[start:end])
+            return
+
+        values = self.struct.unpack_from(data)
+        unpacked = []
+        for (name, field, start, end), value in zip(self.fields, values):
+            if name in raw_values:
+                # Already read directly or assigned, so leave it alone
+                continue
+            raw_values[name] = data[start:end]
+            unpacked.append((name, field, value))
+
+        # Values only get unpacked once all the raw data is in place,
+        # so a fixed value that doesn't match can't leave gaps behind
+        for name, field, value in unpacked:
+            if not has_hooks(field):
+                value = field.unpack(value)
+                if value is not args.NotProvided:
+                    instance.__dict__[name] = value
+
+    def compile_unpack(self):
+        # The same as unpack() and unpack_data() put together, but with all
+        # the details of each field written out ahead of time. Anything out
+        # of the ordinary is passed along to unpack_data() instead.
+        namespace = {
+            'unpack_from': self.struct.unpack_from,
+            'unpack_data': self.unpack_data,
+            'NotProvided': args.NotProvided,
+            'names': frozenset(self.offsets),
+        }
+        lines = [
+            'def unpack(instance):',
+            '    data = instance.read(%d)' % self.size,
+            '    raw_values = instance._raw_values',
+            # Runs later in the structure follow fields that already have values
+            '    if not names.isdisjoint(raw_values) or len(data) < %d:' % self.size,
+            '        return unpack_data(instance, data)',
+            '    %s= unpack_from(data)' % codegen.unpack_targets(len(self.fields)),
+        ]
+        for name, field, start, end in self.fields:
+            lines.append('    raw_values[%r] = data[%d:%d]' % (name, start, end))
+        lines.append('    values = instance.__dict__')
+        for i, (name, field, start, end) in enumerate(self.fields):
+            # Getters and triggers can be added after the class is created,
+            # so they're checked each time rather than ahead of time
+            after_decode = field.after_decode
+            namespace['getters_%d' % i] = field._getters
+            namespace['after_decode_%d' % i] = after_decode
+            namespace['trigger_%d' % i] = after_decode.trigger
+            lines.append('    if not (getters_%d or after_decode_%d.functions or trigger_%d.functions):' % (i, i, i))
+            if self.decoded[i]:
+                lines.append('        values[%r] = v%d' % (name, i))
+            else:
+                namespace['unpack_%d' % i] = field.unpack
+                lines.append('        value = unpack_%d(v%d)' % (i, i))
+                lines.append('        if value is not NotProvided:')
+                lines.append('            values[%r] = value' % name)
+        return codegen.compile_function('unpack', lines, namespace)
+
+    def compile_iter_unpack(self, record_type, indexes, hooked=()):
+        # Generates a function that unpacks consecutive records from a
+        # buffer, decoding only the fields at the given indexes. Fields
+        # named in hooked always go through their decoders, so that any
+        # after_decode functions get to see their values.
+        namespace = {
+            'iter_unpack': self.struct.iter_unpack,
+            'new': tuple.__new__,
+            'record_type': record_type,
+        }
+        values = []
+        for i in indexes:
+            name, field, start, end = self.fields[i]
+            if self.decoded[i] and name not in hooked:
+                values.append('v%d' % i)
+            else:
+                namespace['decode_%d' % i] = get_decoder(field)
+                values.append('decode_%d(v%d)' % (i, i))
+        lines = [
+            'def iter_unpack_records(buffer):',
+            '    for %sin iter_unpack(buffer):' % codegen.unpack_targets(len(self.fields)),
+            '        yield new(record_type, (%s))' % ''.join('%s, ' % value for value in values),
+        ]
+        return codegen.compile_function('iter_unpack_records', lines, namespace)
+
+    def fetch(self, instance, name):
+        # Fixed values get verified before handing out anything else,
+        # just like they would be when reading the structure in order
+        for check in self.checks:
+            if check not in instance._raw_values:
+                self.fetch_field(instance, check)
+        return self.fetch_field(instance, name)
+
+    def fetch_field(self, instance, name):
+        field, start, end, format = self.offsets[name]
+        data = instance._read_at(start, end - start)
+        instance._raw_values[name] = data
+        if len(data) == format.size and not has_hooks(field):
+            value = field.unpack(format.unpack(data)[0])
+            if value is not args.NotProvided:
+                instance.__dict__[name] = value
+        return data
+
+
+def get_struct_format(field):
+    get_struct_format = getattr(field, 'get_struct_format', None)
+    return get_struct_format and get_struct_format()
+
+
+def has_hooks(field):
+    # Getters and after_decode functions need to see each value as it gets
+    # decoded, so those fields can't have values handed to them directly
+    after_decode = field.after_decode
+    return bool(field._getters or after_decode.functions or after_decode.trigger.functions)
+
+
+def get_decoder(field):
+    after_decode = field.after_decode
+
+    def decode(value):
+        decoded = field.unpack(value)
+        if decoded is args.NotProvided:
+            decoded = field.decode(value)
+        if after_decode.functions or after_decode.trigger.functions:
+            # Records are plain tuples, so there's no structure to pass along
+            after_decode.apply(None, decoded)
+        return decoded
+    return decode
+
+
+class CompactField:
+    """
+    Stands in for a field on compact structures, which have no per-instance
+    dictionaries to cache values in. Instead, values are decoded straight
+    from the instance's data each time they're accessed, and assignments
+    are encoded straight back into it.
+    """
+
+    def __init__(self, field, start, end, format):
+        self.field = field
+        self.start = start
+        self.end = end
+        self.format = format
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            # The class still offers the original field, so it can
+            # be referenced the same way as on any other structure
+            return self.field
+
+        field = self.field
+        value = field.unpack(self.format.unpack_from(instance._data, self.start)[0])
+        if value is args.NotProvided:
+            value = field.for_instance(instance).decode(self.get_raw_bytes(instance))
+        # Values decoded by struct still need to go through the triggers
+        field.after_decode.apply(instance, value)
+        for getter in field._getters:
+            value = getter(instance, value)
+        return value
+
+    def __set__(self, instance, value):
+        field = self.field
+        for setter in field._setters:
+            value = setter(instance, value)
+
+        self.set_raw_bytes(instance, field.for_instance(instance).encode(value))
+        field.after_encode.apply(instance, value)
+
+    def get_raw_bytes(self, instance):
+        return instance._data[self.start:self.end]
+
+    def set_raw_bytes(self, instance, data):
+        if len(data) != self.end - self.start:
+            raise ValueError('Expected %s bytes, got %s.' % (self.end - self.start, len(data)))
+        if not isinstance(instance._data, bytearray):
+            # Data that was read in stays untouched until it's changed
+            instance._data = bytearray(instance._data)
+        instance._data[self.start:self.end] = data
@@ -1,6 +1,6 @@
 import collections
 
-from steel.common import data
+from steel.common import data, layout
 
 
 class NameAwareOrderedDict(collections.OrderedDict):
@@ -11,9 +11,9 @@ class NameAwareOrderedDict(collections.OrderedDict):
     """
 
     def __setitem__(self, name, obj):
-        if len(data.field_stack) == 1:
-            # Only assign to the root namespace if it's not nested in a with block
-            super(NameAwareOrderedDict, self).__setitem__(name, obj)
+        # Fields nested in a with block are assigned too, so that other fields
+        # can refer to them, but they're attached to the class by their block
+        super(NameAwareOrderedDict, self).__setitem__(name, obj)
 
         if hasattr(obj, 'set_name'):
             obj.set_name(name)
@@ -42,13 +42,34 @@ class DeclarativeMetaclass(type):
         for name, attr in attrs.items():
             if name in cls._fields and attr is None:
                 del cls._fields[name]
-            if hasattr(attr, 'attach_to_class'):
+            if hasattr(attr, 'attach_to_class') and getattr(attr, 'condition', None) is None:
                 attr.attach_to_class(cls)
 
+        # Fields at the start of the structure with static sizes can
+        # all be read and unpacked at once, rather than one at a time
+        cls._layout = LazyLayout('_layout', layout.Layout.leading)
+        cls._runs = LazyLayout('_runs', layout.Layout.runs)
+
         data.field_options = {}
         data.field_stack = [[]]
 
 
+class LazyLayout:
+    """
+    Works out a layout for a class the first time it's needed, rather than
+    while the class is being created, so that defining a structure doesn't
+    cost anything extra until it's actually used.
+    """
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+
+    def __get__(self, instance, owner):
+        value = self.build(owner._fields.values())
+        setattr(owner, self.name, value)
+        return value
+
+
 class DeclarativeFieldMetaclass(type):
     @classmethod
     def __prepare__(cls, name, bases, **options):
@@ -77,19 +98,3 @@ class DeclarativeFieldMetaclass(type):
         else:
             options = kwargs
         return super(DeclarativeFieldMetaclass, cls).__call__(*args, **options)
-
-
-class AttributeInstance:
-    def __init__(self, field, instance):
-        self.field = field
-        self.instance = instance
-
-    def __enter__(self):
-        if self.instance is not None:
-            data.instance_stack[hash(self.field)].append(self.instance)
-
-    def __exit__(self, exception_type, exception, traceback):
-        if self.instance is not None:
-            data.instance_stack[hash(self.field)].pop()
-
-
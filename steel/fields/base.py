@@ -8,11 +8,6 @@ __all__ = ['Field', 'Reserved']
 class Field(fields.Field):
     offset = args.Argument(default=None, resolve_field=True)
 
-    @fields.Field.after_encode
-    def update_size(self, obj, value):
-        if isinstance(self.size, Field):
-            setattr(obj, self.size.name, len(value))
-
     def read(self, obj):
         # If the size can be determined easily, read
         # that number of bytes and return it directly.
@@ -28,6 +23,14 @@ class Field(fields.Field):
         # fields can/should override it if necessary
         obj.write(value)
 
+    def get_struct_format(self):
+        # Fields that use the standard read() with a static size can be
+        # read as raw bytes along with their neighbors, then decoded later
+        size = self.size
+        if type(self).read is Field.read and isinstance(size, int) and size >= 0:
+            return '%ds' % size
+        return None
+
 
 class Reserved(Field):
     default = args.Override(default=None)
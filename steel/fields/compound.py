@@ -1,8 +1,9 @@
-import io
+import copy
+import struct
 
 from steel.common import args, fields, Remainder
 
-__all__ = ['List', 'Object']
+__all__ = ['List', 'Object', 'SubStructure', 'Switch']
 
 
 class List(fields.Field):
@@ -13,29 +14,36 @@ class List(fields.Field):
         self.field = field
 
     def read(self, file):
-        value_bytes = b''
-        values = []
-        with self.for_instance(self.instance):
-            if self.size == -1:
-                while True:
-                    bytes, value = self.field.read_value(file)
-                    if bytes:
-                        values.append(value)
-                        value_bytes += bytes
-                    else:
-                        break
-            for i in range(self.size):
-                bytes, value = self.field.read_value(file)
-                value_bytes += bytes
-                values.append(value)
+        get_struct_format = getattr(self.field, 'get_struct_format', None)
+        format = get_struct_format and get_struct_format()
+        if format is not None and struct.calcsize(format):
+            return self.read_static(file, struct.calcsize(format))
+
+        field = self.field.for_instance(self.instance)
+        value_bytes, values = field.read_many(file, self.size)
+        raise fields.FullyDecoded(value_bytes, values)
+
+    def read_static(self, file, item_size):
+        # Items with a static size can all be read at once, and then decoded
+        # together, rather than reading and decoding each one separately
+        if self.size == -1:
+            value_bytes = file.read(self.size)
+        else:
+            try:
+                value_bytes = file.read(self.size * item_size)
+            except EOFError:
+                raise fields.Incomplete(self.size * item_size)
+        field = self.field.for_instance(self.instance)
+        values = field.decode_many(value_bytes, item_size)
         raise fields.FullyDecoded(value_bytes, values)
 
     def encode(self, values):
-        encoded_values = []
-        with self.for_instance(self.instance):
-            for value in values:
-                encoded_values.append(self.field.encode(value))
-        return b''.join(encoded_values)
+        return b''.join(self.iter_encode(values))
+
+    def iter_encode(self, values):
+        field = self.field.for_instance(self.instance)
+        for value in values:
+            yield from field.iter_encode(value)
 
 
 class Object(fields.Field):
@@ -45,7 +53,31 @@ class Object(fields.Field):
         self.structure = structure
         super(Object, self).__init__(*args, **kwargs)
 
+    def get_size(self):
+        # The size of the nested structure, if it can be known without
+        # parsing it, either from the field's own size or the structure's
+        if self.size is not None:
+            return self.size
+        try:
+            return self.structure.get_static_layout().size
+        except TypeError:
+            return None
+
+    def get_struct_format(self):
+        # Nested structures with a static size can be skipped over along
+        # with their neighbors, and only get parsed once they're used
+        size = self.get_size()
+        if isinstance(size, int):
+            return '%ds' % size
+        return None
+
     def read(self, file):
+        size = self.get_size()
+        if size is not None:
+            # The data can be set aside without parsing any of it, and
+            # the structure only decodes the parts that actually get used
+            return file.read(size)
+
         value = self.structure(file)
         value._parent = file
 
@@ -55,10 +87,16 @@ class Object(fields.Field):
 
         raise fields.FullyDecoded(value_bytes, value)
 
+    def decode(self, value):
+        value = self.structure(value)
+        value._parent = self.__dict__.get('instance')
+        return value
+
     def encode(self, value):
-        output = io.BytesIO()
-        value.save(output)
-        return output.getvalue()
+        return b''.join(self.iter_encode(value))
+
+    def iter_encode(self, value):
+        return value.iter_raw_bytes()
 
     def __getattr__(self, name):
         if 'structure' in self.__dict__:
@@ -68,3 +106,54 @@ class Object(fields.Field):
                 field._parent = self
                 return field
         raise AttributeError(name)
+
+
+class Switch(fields.Field):
+    """
+    Reads one of several different fields or structures, depending on the
+    value of another field, such as a type code read earlier on. Cases are
+    looked up in a dictionary, so it doesn't matter how many there are.
+    """
+    size = args.Override(default=None)
+
+    def __init__(self, tag, cases, *args, fallback=None, **kwargs):
+        super(Switch, self).__init__(*args, **kwargs)
+        self.tag = tag
+        # Structures are read just like they would be on their own
+        self.cases = {value: get_case_field(case) for value, case in cases.items()}
+        self.fallback = get_case_field(fallback)
+
+    def set_name(self, name):
+        super(Switch, self).set_name(name)
+        for field in list(self.cases.values()) + [self.fallback]:
+            if field is not None:
+                field.set_name(name)
+
+    def get_case(self):
+        tag = self.tag
+        if hasattr(tag, 'resolve'):
+            tag = tag.resolve(self.instance)
+        field = self.cases.get(tag, self.fallback)
+        if field is None:
+            raise ValueError('No case for %r in %s.' % (tag, self.name))
+        return field.for_instance(self.instance)
+
+    def read(self, file):
+        value_bytes, value = self.get_case().read_value(file)
+        raise fields.FullyDecoded(value_bytes, value)
+
+    def encode(self, value):
+        return self.get_case().encode(value)
+
+    def iter_encode(self, value):
+        return self.get_case().iter_encode(value)
+
+
+def get_case_field(case):
+    if isinstance(case, type):
+        return Object(case)
+    return case
+
+
+# The name used for nested structures throughout the examples
+SubStructure = Object
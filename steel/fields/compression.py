@@ -12,8 +12,7 @@ class Zlib(Field):
 
     def decode(self, value):
         data = zlib.decompress(value)
-        with self.for_instance(self.instance):
-            return self.field.decode(data)
+        return self.field.for_instance(self.instance).decode(data)
 
     def encode(self, value):
         data = self.field.encode(value)
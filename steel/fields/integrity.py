@@ -42,8 +42,10 @@ class CheckSum(Integer):
 
     def build_cache(self, instance):
         for field in self.fields:
-            if field.name not in instance._raw_values:
-                # Set the value to itself just to update the encoded value
+            try:
+                instance._extract(field)
+            except IOError:
+                # Set the default value just to get an encoded value
                 setattr(instance, field.name, getattr(instance, field.name))
 
     def read(self, file):
@@ -53,6 +55,10 @@ class CheckSum(Integer):
         except fields.FullyDecoded as obj:
             given_bytes = obj.bytes
             given_value = obj.value
+        if self.name in file._modified:
+            # A new value is being assigned, and the old one is only
+            # being located or skipped over, so there's nothing to verify
+            raise fields.FullyDecoded(given_bytes, given_value)
         self.build_cache(file)
         if given_value != self.get_calculated_value(file):
             raise IntegrityError('%s does not match calculated value' % self.name)
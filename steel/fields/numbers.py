@@ -1,35 +1,80 @@
+import array
 import decimal
+import math
+import struct
+import sys
 
+try:
+    import numpy
+except ImportError:
+    # Lists of floats are decoded into arrays instead
+    numpy = None
+
+from steel.base import get_buffer_reader
 from steel.fields import Field
-from steel.common import args, fields
+from steel.common import args, codegen, fields
 
 __all__ = ['BigEndian', 'LittleEndian', 'SignMagnitude', 'OnesComplement',
            'TwosComplement', 'Integer', 'FixedInteger', 'FixedPoint',
-           'CalculatedValue']
+           'CalculatedValue', 'Float', 'Float16', 'Float32', 'Float64',
+           'Extended80', 'VarInt', 'ZigZag', 'VLQ']
+
+STRUCT_BYTEORDERS = {'big': '>', 'little': '<'}
+STRUCT_INTEGERS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+STRUCT_FLOATS = {2: 'e', 4: 'f', 8: 'd'}
+ARRAY_FLOATS = {4: 'f', 8: 'd'}
+
+# Array type codes vary in size from one platform to the next, so
+# they're looked up by (size, signed) rather than hard-coded
+ARRAY_INTEGERS = {}
+for code in 'bBhHiIlLqQ':
+    ARRAY_INTEGERS.setdefault((array.array(code).itemsize, code.islower()), code)
+del code
 
 
 # Endianness options
 
-class BigEndian:
+class ByteOrder:
+    byteorder = sys.byteorder
+
     def __init__(self, size):
         self.size = size
+        if size in STRUCT_INTEGERS:
+            format = STRUCT_BYTEORDERS[self.byteorder] + STRUCT_INTEGERS[size]
+            self.struct = struct.Struct(format)
+        else:
+            self.struct = None
 
     def encode(self, value):
-        return bytes((value >> (self.size - i - 1) * 8) & 0xff for i in range(self.size))
+        return value.to_bytes(self.size, self.byteorder)
 
     def decode(self, value):
-        return sum(v * 0x100 ** (self.size - i - 1) for i, v in enumerate(value[:self.size]))
+        if self.struct is not None and len(value) >= self.size:
+            return self.struct.unpack_from(value)[0]
+        return int.from_bytes(value[:self.size], self.byteorder)
 
+    def decode_many(self, value, signed=False):
+        # Decodes a whole buffer full of integers of this size at once
+        size = self.size
+        code = ARRAY_INTEGERS.get((size, signed))
+        if code is None or len(value) % size:
+            return [int.from_bytes(value[i:i + size], self.byteorder, signed=signed)
+                    for i in range(0, len(value), size)]
+        if self.byteorder == sys.byteorder or size == 1:
+            # Already in native order, so the buffer can be read in place
+            return memoryview(value).cast('B').cast(code).tolist()
+        values = array.array(code)
+        values.frombytes(value)
+        values.byteswap()
+        return values.tolist()
 
-class LittleEndian:
-    def __init__(self, size):
-        self.size = size
 
-    def encode(self, value):
-        return bytes((value >> i * 8) & 0xff for i in range(self.size))
+class BigEndian(ByteOrder):
+    byteorder = 'big'
 
-    def decode(self, value):
-        return sum(v * 0x100 ** i for i, v in enumerate(value[:self.size]))
+
+class LittleEndian(ByteOrder):
+    byteorder = 'little'
 
 
 # Signed Number Representations
@@ -100,6 +145,9 @@ class Integer(Field):
     endianness = args.Argument(default=BigEndian)
     signing = args.Argument(default=TwosComplement)
 
+    # Integer format codes always produce the final value
+    struct_decoded = True
+
     @signing.init
     def init_signing(self, value):
         return value(self.size * 8)
@@ -123,79 +171,112 @@ class Integer(Field):
             value = self.signing.decode(value)
         return value
 
+    def decode_many(self, value, size):
+        # Plain integers can all be decoded in a single pass, as long as
+        # decoding them one at a time wouldn't do anything different
+        if (size == self.size and type(self).decode is Integer.decode and
+                hasattr(self.endianness, 'decode_many') and
+                (not self.signed or isinstance(self.signing, TwosComplement))):
+            return self.endianness.decode_many(value, signed=self.signed)
+        return super(Integer, self).decode_many(value, size)
+
+    def get_struct_format(self):
+        format = super(Integer, self).get_struct_format()
+        if format is None or type(self).decode is not Integer.decode:
+            # Custom decoding needs to work with the raw bytes
+            return format
+
+        code = STRUCT_INTEGERS.get(self.size)
+        byteorder = STRUCT_BYTEORDERS.get(getattr(self.endianness, 'byteorder', None))
+        if code is None or byteorder is None:
+            return format
+        if self.signed:
+            if not isinstance(self.signing, TwosComplement):
+                return format
+            code = code.lower()
+        if self.size == 1:
+            # Single bytes work the same regardless of byte order
+            return code
+        return byteorder + code
+
+    def unpack(self, value):
+        if isinstance(value, int):
+            return value
+        return args.NotProvided
+
     def __add__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a + b)
+        return CalculatedValue(self, other, '{a} + {b}')
     __radd__ = __add__
 
     def __sub__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a - b)
+        return CalculatedValue(self, other, '{a} - {b}')
 
     def __rsub__(self, other):
-        return CalculatedValue(self, other, lambda a, b: b - a)
+        return CalculatedValue(self, other, '{b} - {a}')
 
     def __mul__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a * b)
+        return CalculatedValue(self, other, '{a} * {b}')
     __rmul__ = __mul__
 
     def __pow__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a ** b)
+        return CalculatedValue(self, other, '{a} ** {b}')
 
     def __rpow__(self, other):
-        return CalculatedValue(self, other, lambda a, b: b ** a)
+        return CalculatedValue(self, other, '{b} ** {a}')
 
     def __truediv__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a / b)
+        return CalculatedValue(self, other, '{a} / {b}')
 
     def __rtruediv__(self, other):
-        return CalculatedValue(self, other, lambda a, b: b / a)
+        return CalculatedValue(self, other, '{b} / {a}')
 
     def __floordiv__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a // b)
+        return CalculatedValue(self, other, '{a} // {b}')
 
     def __rfloordiv__(self, other):
-        return CalculatedValue(self, other, lambda a, b: b // a)
+        return CalculatedValue(self, other, '{b} // {a}')
 
     def __divmod__(self, other):
-        return CalculatedValue(self, other, lambda a, b: divmod(a, b))
+        return CalculatedValue(self, other, 'divmod({a}, {b})')
 
     def __rdivmod__(self, other):
-        return CalculatedValue(self, other, lambda a, b: divmod(b, a))
+        return CalculatedValue(self, other, 'divmod({b}, {a})')
 
     def __and__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a & b)
+        return CalculatedValue(self, other, '{a} & {b}')
     __rand__ = __and__
 
     def __or__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a | b)
+        return CalculatedValue(self, other, '{a} | {b}')
     __ror__ = __or__
 
     def __xor__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a ^ b)
+        return CalculatedValue(self, other, '{a} ^ {b}')
     __rxor__ = __xor__
 
     def __lshift__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a << b)
+        return CalculatedValue(self, other, '{a} << {b}')
 
     def __rlshift__(self, other):
-        return CalculatedValue(self, other, lambda a, b: b << a)
+        return CalculatedValue(self, other, '{b} << {a}')
 
     def __rshift__(self, other):
-        return CalculatedValue(self, other, lambda a, b: a >> b)
+        return CalculatedValue(self, other, '{a} >> {b}')
 
     def __rrshift__(self, other):
-        return CalculatedValue(self, other, lambda a, b: b >> a)
+        return CalculatedValue(self, other, '{b} >> {a}')
 
     def __lt__(self, other):
-        return fields.Condition(self, other, lambda a, b: a < b)
+        return fields.Condition(self, other, '<')
 
-    def __lte__(self, other):
-        return fields.Condition(self, other, lambda a, b: a <= b)
+    def __le__(self, other):
+        return fields.Condition(self, other, '<=')
 
-    def __gte__(self, other):
-        return fields.Condition(self, other, lambda a, b: a >= b)
+    def __ge__(self, other):
+        return fields.Condition(self, other, '>=')
 
     def __gt__(self, other):
-        return fields.Condition(self, other, lambda a, b: a > b)
+        return fields.Condition(self, other, '>')
 
 
 class FixedInteger(Integer):
@@ -235,38 +316,404 @@ class FixedPoint(Integer):
 
 
 class CalculatedValue(Integer):
-    def __init__(self, field, other, calculate, **kwargs):
+    """
+    The result of doing arithmetic with an integer field. However many
+    operations are chained together, the whole expression is compiled into
+    a single function as soon as it's created, with any constants that
+    appear in a row combined ahead of time.
+    """
+    def __init__(self, field, other, expression, **kwargs):
         super(CalculatedValue, self).__init__(size=field.size, **kwargs)
         self.field = field
         self._parent = field._parent
-        if isinstance(other, Field) and self.instance:
-            other = getattr(self.instance, other.name)
         self.other = other
-        self.calculate = calculate
+        self.expression = expression
         if hasattr(field, 'name'):
             self.set_name(field.name)
 
+        # Resolving against an instance starts from the nearest field that
+        # has a value of its own, while decoding starts from the raw bytes
+        self.root, self.calculate, self.leaves = compile_calculation(self, full=False)
+        self.base, self.calculate_decoded, _ = compile_calculation(self, full=True)
+
+        # Values that come through other structures could change without this
+        # one knowing about it, so only values from this one can be cached
+        self.cacheable = all(leaf._parent is None for leaf in self.leaves)
+
     def read(self, file):
         # Defer to the stored field in order to get a base value
-        with self.for_instance(self.instance):
-            return self.field.read(file)
+        return self.field.for_instance(self.instance).read(file)
 
     def encode(self, value):
         return self.field.encode(value)
 
     def decode(self, value):
-        return self.calculate(self.field.decode(value), self.other)
+        return self.calculate_decoded(self.base.decode(value), self.__dict__.get('instance'))
+
+    def resolve(self, instance):
+        if self.root is self:
+            # The value was calculated as it was decoded
+            return super(CalculatedValue, self).resolve(instance)
+
+        calculated = getattr(instance, '_calculated', None)
+        if calculated is not None and id(self) in calculated:
+            return calculated[id(self)]
+        value = self.calculate(fields.Field.resolve(self.root, instance), instance)
+        if calculated is not None and self.cacheable:
+            calculated[id(self)] = value
+        return value
+
+
+# Operations with constants that can be combined when they follow each other
+FOLDABLE = {
+    '{a} + {b}': ('+', 1),
+    '{a} - {b}': ('+', -1),
+    '{a} * {b}': ('*', 1),
+}
+
+
+def compile_calculation(value, full):
+    # Returns the field the calculation starts from, a function that applies
+    # all the calculations to that field's value and the fields it refers to
+    steps = []
+    while isinstance(value, CalculatedValue) and (full or hasattr(value.field, 'name')):
+        steps.append((value.expression, value.other))
+        value = value.field
+    steps.reverse()
+
+    namespace = {}
+    leaves = [value]
+    expression = 'value'
+    folded = None
+    for template, other in steps:
+        fold = FOLDABLE.get(template)
+        if fold and isinstance(other, int):
+            operator, sign = fold
+            if folded is not None and folded[0] == operator:
+                if operator == '+':
+                    folded = (operator, folded[1] + sign * other)
+                else:
+                    folded = (operator, folded[1] * other)
+                continue
+            expression = apply_folded(expression, folded)
+            folded = (operator, sign * other)
+            continue
+        expression = apply_folded(expression, folded)
+        folded = None
+        operand = get_operand(other, namespace, leaves)
+        expression = '(%s)' % template.format(a=expression, b=operand)
+    expression = apply_folded(expression, folded)
+
+    lines = [
+        'def calculate(value, instance):',
+        '    return %s' % expression,
+    ]
+    return value, codegen.compile_function('calculate', lines, namespace), leaves
+
+
+def apply_folded(expression, folded):
+    if folded is None:
+        return expression
+    operator, constant = folded
+    if (operator, constant) in (('+', 0), ('*', 1)):
+        # Nothing left to do after all
+        return expression
+    return '(%s %s %r)' % (expression, operator, constant)
+
+
+def get_operand(other, namespace, leaves):
+    name = 'operand_%d' % len(namespace)
+    if hasattr(other, 'resolve'):
+        # Other fields are resolved against the same instance
+        namespace[name] = other.resolve
+        leaves.extend(getattr(other, 'leaves', [other]))
+        return '%s(instance)' % name
+    if type(other) is int:
+        return repr(other)
+    namespace[name] = other
+    return name
+
+
+# Floating point types
+
+class Float(Field):
+    """
+    An IEEE-754 floating point number, in any of the sizes that struct
+    supports: 2, 4 or 8 bytes. Lists of them are decoded all at once, into
+    a NumPy array if NumPy is installed, or an array otherwise.
+    """
+    size = args.Override(resolve_field=False)
+
+    endianness = args.Argument(default=BigEndian)
+
+    # Float format codes always produce the final value
+    struct_decoded = True
+
+    @endianness.init
+    def init_endianness(self, value):
+        return value(self.size)
+
+    def __init__(self, *args, **kwargs):
+        super(Float, self).__init__(*args, **kwargs)
+        if self.size not in STRUCT_FLOATS:
+            raise TypeError('Floats must be 2, 4 or 8 bytes, not %r' % self.size)
+        byteorder = STRUCT_BYTEORDERS[self.endianness.byteorder]
+        self.struct = struct.Struct(byteorder + STRUCT_FLOATS[self.size])
+
+    def encode(self, value):
+        try:
+            return self.struct.pack(value)
+        except (struct.error, OverflowError):
+            raise ValueError("Value is too large for this field.")
+
+    def decode(self, value):
+        return self.struct.unpack_from(value)[0]
+
+    def decode_many(self, value, size):
+        if size != self.size or len(value) % size or type(self).decode is not Float.decode:
+            return super(Float, self).decode_many(value, size)
+
+        byteorder = self.endianness.byteorder
+        if numpy is not None:
+            # NumPy can work with the buffer as-is, without copying it
+            dtype = numpy.dtype('%sf%d' % (STRUCT_BYTEORDERS[byteorder], size))
+            return numpy.frombuffer(value, dtype)
+
+        code = ARRAY_FLOATS.get(size)
+        if code is None:
+            # Arrays can't hold half-precision values, so widen them
+            return array.array('d', (value for value, in self.struct.iter_unpack(value)))
+        values = array.array(code)
+        values.frombytes(value)
+        if byteorder != sys.byteorder:
+            values.byteswap()
+        return values
+
+    def get_struct_format(self):
+        if type(self).decode is not Float.decode:
+            # Custom decoding needs to work with the raw bytes
+            return super(Float, self).get_struct_format()
+        return self.struct.format
+
+    def unpack(self, value):
+        if isinstance(value, float):
+            return value
+        return args.NotProvided
+
+
+class Float16(Float):
+    size = args.Override(default=2)
+
+
+class Float32(Float):
+    size = args.Override(default=4)
+
+
+class Float64(Float):
+    size = args.Override(default=8)
+
+
+class Extended80(Field):
+    """
+    The 80-bit extended precision format used by x87 processors and found
+    in formats like AIFF. Python floats only have double precision, so any
+    extra precision is rounded away as values are decoded.
+    """
+    size = args.Override(default=10, resolve_field=False)
+
+    endianness = args.Argument(default=BigEndian)
+
+    @endianness.init
+    def init_endianness(self, value):
+        return value(self.size)
+
+    def encode(self, value):
+        value = float(value)
+        sign = int(math.copysign(1, value) < 0) << 79
+        if math.isnan(value):
+            exponent, mantissa = 0x7fff, 0xc000000000000000
+        elif math.isinf(value):
+            exponent, mantissa = 0x7fff, 0x8000000000000000
+        elif value == 0:
+            exponent, mantissa = 0, 0
+        else:
+            # Unlike doubles, the leading bit of the mantissa is explicit
+            mantissa, exponent = math.frexp(abs(value))
+            exponent += 16382
+            mantissa = int(mantissa * (1 << 64))
+        return (sign | exponent << 64 | mantissa).to_bytes(10, self.endianness.byteorder)
+
+    def decode(self, value):
+        value = int.from_bytes(value[:10], self.endianness.byteorder)
+        sign = -1.0 if value >> 79 else 1.0
+        exponent = (value >> 64) & 0x7fff
+        mantissa = value & 0xffffffffffffffff
+        if exponent == 0x7fff:
+            if mantissa & 0x7fffffffffffffff:
+                return math.nan
+            return sign * math.inf
+        try:
+            return sign * math.ldexp(mantissa, exponent - 16383 - 63)
+        except OverflowError:
+            # Too large to fit in a double
+            return sign * math.inf
+
+    def decode_many(self, value, size):
+        return array.array('d', super(Extended80, self).decode_many(value, size))
+
+
+# Variable-length types
+
+class VarInt(Field):
+    """
+    A variable-length unsigned integer, as used by Protocol Buffers and
+    LEB128. Each byte holds seven bits of the value, least significant
+    first, and its high bit is set if there are more bytes to follow.
+    """
+    size = args.Override(default=None)
 
-    def resolve(self, value):
-        if hasattr(self.field, 'name'):
-            resolved_value = self.field.resolve(value)
+    def read(self, file):
+        reader = get_buffer_reader(file)
+        if reader is not None:
+            # The end can be found right in the buffer, so the whole
+            # value only needs to be read once
+            buffer = reader.buffer
+            start = end = reader.tell()
+            while end < len(buffer):
+                end += 1
+                if buffer[end - 1] < 0x80:
+                    return file.read(end - start)
+            if end > start:
+                # The data ran out partway through the value
+                raise EOFError
+            # Nothing left at all, which only some files consider an error
+            return file.read(1)
+
+        value = b''
+        while True:
+            byte = file.read(1)
+            if not byte:
+                if value:
+                    raise EOFError
+                return value
+            value += byte
+            if byte[0] < 0x80:
+                return value
+
+    def read_many(self, file, count):
+        reader = get_buffer_reader(file)
+        if reader is None:
+            return super(VarInt, self).read_many(file, count)
+        if count == 0:
+            return file.read(0), []
+        size, values = self.scan(reader.buffer[reader.tell():], count)
+        if len(values) < count:
+            # Asking for more than is left lets files that can tell
+            # the data isn't finished yet raise an EOFError
+            try:
+                return file.read(size + 1), values
+            except EOFError:
+                # Each value that's left needs at least another byte
+                raise fields.Incomplete(size + count - len(values))
+        return file.read(size), values
+
+    def get_min_size(self):
+        return 1
+
+    def scan(self, buffer, count):
+        # Decodes values straight out of the buffer, all in one pass,
+        # returning how many bytes they took up along with the values
+        values = []
+        value = shift = 0
+        size = 0
+        for size, byte in enumerate(buffer, 1):
+            value |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+                continue
+            values.append(value)
+            if len(values) == count:
+                break
+            value = shift = 0
         else:
-            return super(CalculatedValue, self).resolve(value)
+            if shift:
+                # The data ran out partway through one last value
+                raise fields.Incomplete(size + max(count - len(values), 1))
+        return size, values
 
-        resolved_other = self.other
-        if hasattr(self.other, 'resolve'):
-            resolved_other = self.other.resolve(value)
+    def encode(self, value):
+        if value < 0:
+            raise ValueError("Value cannot be negative.")
+        encoded = bytearray()
+        while value > 0x7f:
+            encoded.append(value & 0x7f | 0x80)
+            value >>= 7
+        encoded.append(value)
+        return bytes(encoded)
 
-        return self.calculate(resolved_value, resolved_other)
+    def decode(self, value):
+        result = 0
+        for i, byte in enumerate(value):
+            result |= (byte & 0x7f) << (i * 7)
+        return result
+
+
+class ZigZag(VarInt):
+    """
+    A signed VarInt, as used by Protocol Buffers for its sint types, which
+    interleaves positive and negative values so small ones of either sign
+    still only take up a single byte.
+    """
+    def scan(self, buffer, count):
+        size, values = super(ZigZag, self).scan(buffer, count)
+        return size, [(value >> 1) ^ -(value & 1) for value in values]
 
+    def encode(self, value):
+        if value < 0:
+            return super(ZigZag, self).encode((-value << 1) - 1)
+        return super(ZigZag, self).encode(value << 1)
 
+    def decode(self, value):
+        value = super(ZigZag, self).decode(value)
+        return (value >> 1) ^ -(value & 1)
+
+
+class VLQ(VarInt):
+    """
+    A variable-length quantity, as used by MIDI files. These work just like
+    a VarInt, except that the most significant seven bits come first.
+    """
+    def scan(self, buffer, count):
+        values = []
+        value = 0
+        size = 0
+        for size, byte in enumerate(buffer, 1):
+            value = (value << 7) | (byte & 0x7f)
+            if byte & 0x80:
+                continue
+            values.append(value)
+            if len(values) == count:
+                break
+            value = 0
+        else:
+            if size and buffer[size - 1] & 0x80:
+                # The data ran out partway through one last value
+                raise fields.Incomplete(size + max(count - len(values), 1))
+        return size, values
+
+    def encode(self, value):
+        if value < 0:
+            raise ValueError("Value cannot be negative.")
+        encoded = bytearray([value & 0x7f])
+        value >>= 7
+        while value:
+            encoded.append(value & 0x7f | 0x80)
+            value >>= 7
+        encoded.reverse()
+        return bytes(encoded)
+
+    def decode(self, value):
+        result = 0
+        for byte in value:
+            result = (result << 7) | (byte & 0x7f)
+        return result
@@ -1,3 +1,4 @@
+from steel.base import read_until
 from steel.fields import Field
 from steel.fields.numbers import Integer
 from steel.common import args
@@ -14,21 +15,26 @@ class String(Field):
         if self.size is not None:
             return file.read(self.size)
 
-        else:
-            # TODO: There's gotta be a better way, but it works for now
-            value = b''
-            while True:
-                data = file.read(1)
-                if data:
-                    value += data
-                    if data == self.terminator:
-                        break
-                else:
-                    break
+        # The terminator can be found in whatever the file has buffered,
+        # rather than checking each byte as it's read
+        return read_until(file, self.terminator)
 
-        return value
+    def get_min_size(self):
+        if self.size is None:
+            # Even an empty string has its terminator
+            return len(self.terminator)
+        return super(String, self).get_min_size()
+
+    def get_struct_format(self):
+        # Strings with a static size read just like any other field
+        if type(self).read is String.read and isinstance(self.size, int):
+            return '%ds' % self.size
+        return None
 
     def decode(self, value):
+        # Buffer-backed structures supply memoryviews, which need to become
+        # real bytes before they can be stripped and decoded
+        value = bytes(value)
         return value.rstrip(self.terminator).rstrip(self.padding).decode(self.encoding)
 
     def encode(self, value):
@@ -50,11 +56,11 @@ class LengthIndexedString(String):
     def read(self, file):
         size_bytes, size = Integer(size=self.size).read_value(file)
         value_bytes = file.read(size)
-        return size_bytes + value_bytes
+        return b''.join((size_bytes, value_bytes))
 
     def decode(self, value):
         # Skip the length portion of the byte string before decoding
-        return value[self.size:].decode(self.encoding)
+        return bytes(value[self.size:]).decode(self.encoding)
 
     def encode(self, value):
         value_bytes = value.encode(self.encoding)
@@ -68,6 +74,9 @@ class FixedString(String):
     padding = args.Override(default=b'')
     terminator = args.Override(default=b'')
 
+    # Always validated, even when other fields are accessed directly
+    always_read = True
+
     def __init__(self, value, *args, **kwargs):
         super(FixedString, self).__init__(*args, **kwargs)
 
@@ -92,6 +101,13 @@ class FixedString(String):
 
         raise FullyDecoded(self.encoded_value, self.decoded_value)
 
+    def get_struct_format(self):
+        return '%ds' % self.size
+
+    def unpack(self, value):
+        # Always validate right away, just like read() does
+        return self.decode(value)
+
     def decode(self, value):
         if value != self.encoded_value:
             raise ValueError('Expected %r, got %r.' % (self.encoded_value, value))
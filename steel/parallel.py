@@ -0,0 +1,104 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+
+from steel.base import CompactStructure, StructureBase, StructureStreamer, map_file
+
+__all__ = ['parse_parallel']
+
+
+def parse_parallel(structure, path, max_workers=None, records_per_task=65536):
+    """
+    Parses a file full of consecutive records using a pool of processes,
+    yielding a named tuple for each record, in order. Each process maps the
+    file into memory on its own, so the data itself is shared by way of the
+    operating system rather than being copied between processes.
+
+    Nested structures come back as named tuples of their own, and lists of
+    values as plain lists.
+
+    The structure needs to be importable by the worker processes, so it has
+    to be defined at the top level of a module, along with any structures
+    nested inside it.
+    """
+    with open(path, 'rb') as file:
+        buffer = map_file(file)
+    record_type = structure.get_record_type()
+
+    try:
+        size = structure.get_static_layout().size
+    except TypeError:
+        # Records have to be parsed once just to find out where they are,
+        # but all the decoding can still be done in parallel
+        offsets = StructureStreamer(structure).find_offsets(buffer)
+        tasks = [(parse_records, offsets[i:i + records_per_task + 1])
+                 for i in range(0, len(offsets) - 1, records_per_task)]
+    else:
+        end = len(buffer)
+        if end % size:
+            raise EOFError('Expected a multiple of %s bytes, got %s.' % (size, end))
+        step = size * records_per_task
+        tasks = [(unpack_records, start, min(start + step, end))
+                 for start in range(0, end, step)]
+    del buffer
+
+    max_workers = max_workers or os.cpu_count() or 1
+    tasks = iter(tasks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        # Only keep a few tasks ahead of the records being used, so the
+        # results for an entire file don't have to be in memory at once
+        futures = collections.deque()
+        for function, *args in itertools.islice(tasks, max_workers * 2):
+            futures.append(executor.submit(function, structure, path, *args))
+        while futures:
+            records = futures.popleft().result()
+            for function, *args in itertools.islice(tasks, 1):
+                futures.append(executor.submit(function, structure, path, *args))
+            for values in records:
+                yield record_type._make(values)
+
+
+def unpack_records(structure, path, start, end):
+    # Fixed-size records can be unpacked in bulk
+    with open(path, 'rb') as file:
+        buffer = map_file(file)
+    records = [tuple(detach(value) for value in record)
+               for record in structure.iter_unpack(memoryview(buffer)[start:end])]
+    return records
+
+
+def parse_records(structure, path, offsets):
+    with open(path, 'rb') as file:
+        buffer = map_file(file)
+    view = memoryview(buffer)
+    names = structure.get_record_type()._fields
+    records = []
+    for start, end in zip(offsets, offsets[1:]):
+        value = structure(view[start:end])
+        records.append(tuple(get_values(value, names)))
+    return records
+
+
+def get_values(value, names):
+    for name in names:
+        field = value._fields[name]
+        if field.condition is not None and not field.is_present(value):
+            # Absent fields still have a place in the record type
+            yield None
+        else:
+            yield detach(getattr(value, name))
+
+
+def detach(value):
+    # Values sliced straight out of the file can't be sent back to the
+    # main process without being copied into bytes of their own
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    # The same goes for anything inside nested structures and lists
+    if isinstance(value, (StructureBase, CompactStructure)):
+        record_type = value.get_record_type()
+        return record_type._make(get_values(value, record_type._fields))
+    if isinstance(value, list):
+        return [detach(item) for item in value]
+    return value
@@ -0,0 +1,179 @@
+import asyncio
+import collections
+
+from steel.base import EOFBufferReader, get_needed_size
+
+__all__ = ['StructureParser', 'StructureProtocol', 'parse_stream']
+
+
+class StructureParser:
+    """
+    Turns data arriving in arbitrary pieces into a sequence of structures,
+    without doing any I/O of its own. Records are parsed in place, from
+    the data itself if nothing else is waiting, or otherwise from a single
+    copy of everything that's arrived so far. Any partial record at the
+    end is held onto until the data it needs to be finished has arrived.
+    """
+    def __init__(self, structure):
+        if not structure._fields:
+            raise TypeError('%s has no fields to parse' % structure.__name__)
+        self.structure = structure
+        self.pending = bytearray()
+        self.needed = 0
+        self.last_field = list(structure._fields.values())[-1]
+        try:
+            self.size = structure.get_static_layout().size
+        except TypeError:
+            # Records have to be parsed in order to know where they end
+            self.size = None
+
+    def feed(self, data):
+        if not self.pending and isinstance(data, bytes):
+            # Nothing's waiting and the data can't change, so records
+            # can refer to it directly
+            buffer = data
+        else:
+            self.pending += data
+            if len(self.pending) < self.needed:
+                # Still not enough for the next record to get any further
+                return []
+            # Records refer to the data they came from, so they need a copy
+            # that won't change as more data arrives
+            buffer = bytes(self.pending)
+
+        if self.size is not None:
+            records, consumed = self.split(buffer)
+        else:
+            records, consumed = self.parse(buffer)
+
+        if buffer is data:
+            self.pending += memoryview(data)[consumed:]
+        else:
+            del self.pending[:consumed]
+        return records
+
+    def split(self, buffer):
+        # Every record is the same size, so they can be sliced apart without
+        # reading anything, and each one gets decoded whenever it's used
+        view = memoryview(buffer)
+        size = self.size
+        end = len(buffer) - len(buffer) % size
+        records = [self.structure(view[start:start + size]) for start in range(0, end, size)]
+        self.needed = size
+        return records, end
+
+    def parse(self, buffer):
+        reader = EOFBufferReader(buffer)
+        records = []
+        while reader.tell() < len(buffer):
+            start = reader.tell()
+            record = self.structure(reader)
+            try:
+                # Reading the raw bytes for the last field reads everything
+                # before it too, but only decodes fields that sizes depend on
+                record._extract(self.last_field)
+            except EOFError as error:
+                # The rest of the record hasn't arrived yet, but at least
+                # the size of the field that ran out might be known
+                self.needed = get_needed_size_in(record, len(buffer) - start, error)
+                return records, start
+            records.append(record)
+        self.needed = 0
+        return records, len(buffer)
+
+
+def get_needed_size_in(record, available, error):
+    # How much of a partial record needs to arrive before it can get any
+    # further. Everything before the field that ran out was read in full.
+    position = sum(len(value) for value in record._raw_values.values())
+    for name, field in record._fields.items():
+        if name not in record._raw_values:
+            field = field.for_instance(record)
+            needed = max(get_needed_size(field, available - position), getattr(error, 'needed', 0))
+            return position + needed
+    return available + 1
+
+
+class StructureProtocol(asyncio.BufferedProtocol):
+    """
+    An asyncio protocol that parses structures from a connection as data
+    arrives, reading directly into a single receive buffer that gets
+    reused for the life of the connection. Records are passed to the
+    callback, if one is given, or can be collected using `async for`.
+    """
+    def __init__(self, structure, callback=None, buffer_size=65536, max_records=1024):
+        self.parser = StructureParser(structure)
+        self.buffer = bytearray(buffer_size)
+        self.callback = callback
+        self.max_records = max_records
+        self.records = collections.deque()
+        self.transport = None
+        self.waiter = None
+        self.closed = False
+        self.exception = None
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.buffer
+
+    def buffer_updated(self, nbytes):
+        for record in self.parser.feed(memoryview(self.buffer)[:nbytes]):
+            if self.callback is not None:
+                self.callback(record)
+            else:
+                self.records.append(record)
+        if len(self.records) >= self.max_records and not self.paused:
+            # Records aren't being used as fast as they come in
+            self.transport.pause_reading()
+            self.paused = True
+        self.wake_up()
+
+    def eof_received(self):
+        # Let the transport close itself
+        return False
+
+    def connection_lost(self, exception):
+        if exception is None and self.parser.pending:
+            exception = EOFError('Connection closed in the middle of a record')
+        self.closed = True
+        self.exception = exception
+        self.wake_up()
+
+    def wake_up(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+        self.waiter = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.records:
+            if self.closed:
+                if self.exception is not None:
+                    raise self.exception
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+
+        record = self.records.popleft()
+        if self.paused and len(self.records) <= self.max_records // 2:
+            self.transport.resume_reading()
+            self.paused = False
+        return record
+
+
+async def parse_stream(structure, reader, chunk_size=65536):
+    # The same as StructureProtocol, but for an asyncio.StreamReader
+    parser = StructureParser(structure)
+    while True:
+        data = await reader.read(chunk_size)
+        if not data:
+            break
+        for record in parser.feed(data):
+            yield record
+    if parser.pending:
+        raise EOFError('Stream ended in the middle of a record')
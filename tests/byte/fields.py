@@ -1,5 +1,7 @@
+import gc
 import io
 import unittest
+import weakref
 
 import steel
 
@@ -22,6 +24,84 @@ class IOTest(unittest.TestCase):
         self.assertEqual(self.output.getvalue(), self.data)
 
 
+class InstanceTest(unittest.TestCase):
+    def setUp(self):
+        class TestStructure(steel.Structure):
+            length = steel.Integer(size=1)
+            content = steel.Bytes(size=length - 1)
+
+        self.struct = TestStructure
+
+    def test_for_instance(self):
+        struct = self.struct(b'\x05test')
+        field = self.struct.content.for_instance(struct)
+        self.assertEqual(field.size, 4)
+        self.assertIs(field.instance, struct)
+
+        # The original field is left alone
+        self.assertIsNone(self.struct.content.instance)
+        self.assertIsInstance(self.struct.content.size, steel.Field)
+
+    def test_no_instance(self):
+        self.assertIs(self.struct.content.for_instance(None), self.struct.content)
+
+    def test_resolve(self):
+        struct = self.struct(io.BytesIO(b'\x05test'))
+        self.assertEqual(struct.content, b'test')
+
+
+class TriggerTest(unittest.TestCase):
+    class TestStructure(steel.Structure):
+        length = steel.Integer(size=1)
+        content = steel.Bytes(size=length)
+
+    def test_class_functions(self):
+        # Every field updates its size when it's assigned
+        struct = self.TestStructure(content=b'test')
+        self.assertEqual(struct.length, 4)
+
+    def test_field_functions(self):
+        calls = []
+        field = steel.Integer(size=1)
+        field.after_decode(lambda instance, value: calls.append(value))
+        field.after_decode.apply(None, 42)
+        self.assertEqual(calls, [42])
+
+        # Copies of a field don't share its functions
+        field.for_instance(self).after_decode.apply(None, 66)
+        self.assertEqual(calls, [42])
+
+    def test_after_decode(self):
+        class Header(steel.Structure):
+            a = steel.Integer(size=1)
+            b = steel.Integer(size=1)
+
+        class Record(steel.Structure, compact=True):
+            a = steel.Integer(size=1)
+
+        calls = []
+        Header.a.after_decode(lambda instance, value: calls.append(value))
+        Record.a.after_decode(lambda instance, value: calls.append(value))
+
+        # Values decoded along with the rest of the layout still get seen
+        self.assertEqual(Header(io.BytesIO(b'\x05\x06')).b, 6)
+        self.assertEqual(calls, [])
+        for source in (io.BytesIO(b'\x05\x06'), b'\x05\x06'):
+            self.assertEqual(Header(source).a, 5)
+        self.assertEqual(Record(b'\x07').a, 7)
+        self.assertEqual([record.a for record in Header.iter_unpack(b'\x08\x00')], [8])
+        self.assertEqual(calls, [5, 5, 7, 8])
+
+    def test_release(self):
+        field = steel.Integer(size=1) + 1
+        field.after_encode
+        field.field.after_decode
+        reference = weakref.ref(field)
+        del field
+        gc.collect()
+        self.assertIsNone(reference())
+
+
 class EndiannessTest(unittest.TestCase):
     decoded_value = 42
     
@@ -37,6 +117,15 @@ class EndiannessTest(unittest.TestCase):
         self.assertEqual(endianness.encode(self.decoded_value), encoded_value)
         self.assertEqual(endianness.decode(encoded_value), self.decoded_value)
 
+    def test_decode_many(self):
+        data = b'\x00*\xff\xfe'
+        self.assertEqual(steel.BigEndian(size=2).decode_many(data), [42, 65534])
+        self.assertEqual(steel.LittleEndian(size=2).decode_many(data), [10752, 65279])
+        self.assertEqual(steel.BigEndian(size=2).decode_many(data, signed=True), [42, -2])
+
+        # Sizes without a native type are decoded one at a time instead
+        self.assertEqual(steel.BigEndian(size=3).decode_many(b'\x00\x00*\x00\x01\x00'), [42, 256])
+
 
 class SigningTest(unittest.TestCase):
     decoded_value = -42
@@ -152,6 +241,42 @@ class CalculatedValueTest(unittest.TestCase):
         calc_field = (self.field + 2 - 2) * 5 // 4
         self.assertEqual(calc_field.decode(b'\x2a'), 52)
 
+    def test_resolve(self):
+        class TestStructure(steel.Structure):
+            width = steel.Integer(size=1)
+            height = steel.Integer(size=1)
+            count = steel.Integer(size=1) + 1
+            data = steel.Bytes(size=(width * height + 2 - 2) // 2)
+            extra = steel.Bytes(size=count - 1)
+
+        struct = TestStructure(b'\x02\x03\x02abcXY')
+        self.assertEqual(bytes(struct.data), b'abc')
+        self.assertEqual(bytes(struct.extra), b'XY')
+
+    def test_cache(self):
+        class TestStructure(steel.Structure):
+            length = steel.Integer(size=1)
+            data = steel.Bytes(size=length * 2)
+
+        size = TestStructure.data.__dict__['size']
+        struct = TestStructure(b'\x01ab')
+        self.assertEqual(size.resolve(struct), 2)
+        self.assertIn(id(size), struct._calculated)
+
+        # Assigning anything means values need to be calculated again
+        struct.length = 2
+        self.assertEqual(size.resolve(struct), 4)
+
+    def test_compare(self):
+        class TestStructure(steel.Structure):
+            version = steel.Integer(size=1)
+            with version >= 2:
+                flags = steel.Integer(size=1)
+
+        self.assertEqual(TestStructure(b'\x02\x2a').flags, 42)
+        with self.assertRaises(AttributeError):
+            TestStructure(b'\x01').flags
+
 
 class StringTest(unittest.TestCase):
     def test_ascii(self):
@@ -168,6 +293,31 @@ class StringTest(unittest.TestCase):
         self.assertEqual(field.encode('\u00fcber'), b'\xc3\xbcber\x00')
         self.assertEqual(field.decode(b'\xc3\xbcber\x00'), '\u00fcber')
 
+    def test_read(self):
+        class Names(steel.Structure):
+            first = steel.String(encoding='ascii')
+            second = steel.String(encoding='ascii', terminator=b'\r\n')
+            end = steel.Integer(size=1)
+
+        # Long enough that the terminator isn't in the first search
+        first = 'x' * 1000
+        data = first.encode('ascii') + b'\x00ab\r\n\x2a'
+        sources = [
+            data,
+            io.BytesIO(data),
+            io.BufferedReader(io.BytesIO(data), buffer_size=16),
+        ]
+        for source in sources:
+            names = Names(source)
+            self.assertEqual(names.first, first)
+            self.assertEqual(names.second, 'ab')
+            self.assertEqual(names.end, 42)
+
+    def test_read_unterminated(self):
+        field = steel.String(encoding='ascii')
+        bytes, value = field.read_value(io.BufferedReader(io.BytesIO(b'test')))
+        self.assertEqual(value, 'test')
+
 
 class LengthIndexedString(unittest.TestCase):
     encoded_data = b'\x05valid'
@@ -232,6 +382,83 @@ class BytesTest(unittest.TestCase):
         self.assertEqual(field.decode(self.data), self.data)
 
 
+class FloatTest(unittest.TestCase):
+    def test_sizes(self):
+        self.assertEqual(steel.Float16().encode(1.5), b'\x3e\x00')
+        self.assertEqual(steel.Float32().encode(1.5), b'\x3f\xc0\x00\x00')
+        self.assertEqual(steel.Float64(endianness=steel.LittleEndian).decode(b'\x00\x00\x00\x00\x00\x00\xf8\x3f'), 1.5)
+
+        with self.assertRaises(TypeError):
+            steel.Float(size=3)
+
+        # Values that don't fit can't be encoded
+        with self.assertRaises(ValueError):
+            steel.Float16().encode(1e10)
+
+    def test_extended(self):
+        field = steel.Extended80()
+        # 44.1kHz, as found in AIFF files
+        self.assertEqual(field.encode(44100), b'\x40\x0e\xac\x44\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(field.decode(b'\x40\x0e\xac\x44\x00\x00\x00\x00\x00\x00'), 44100)
+        for value in (0.0, -2.5, 1e-300, float('inf')):
+            self.assertEqual(field.decode(field.encode(value)), value)
+
+    def test_list(self):
+        class Samples(steel.Structure, endianness=steel.LittleEndian):
+            rate = steel.Float32()
+            samples = steel.List(steel.Float32(), size=steel.Remainder)
+
+        samples = Samples(b'\x00\x00\x80\x3f\x00\x00\x00\x40\x00\x00\x40\xc0')
+        self.assertEqual(samples.rate, 1.0)
+        self.assertSequenceEqual(list(samples.samples), [2.0, -3.0])
+
+
+class VarIntTest(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(steel.VarInt().encode(300), b'\xac\x02')
+        self.assertEqual(steel.ZigZag().encode(-2), b'\x03')
+        self.assertEqual(steel.VLQ().encode(0x3fff), b'\xff\x7f')
+
+        with self.assertRaises(ValueError):
+            steel.VarInt().encode(-1)
+
+    def test_read(self):
+        class Message(steel.Structure):
+            id = steel.VarInt()
+            offset = steel.ZigZag()
+            delta = steel.VLQ()
+            end = steel.Integer(size=1)
+
+        data = b'\xac\x02\x03\x81\x00\x2a'
+        for source in (data, io.BytesIO(data)):
+            message = Message(source)
+            self.assertEqual(message.end, 42)
+            self.assertEqual((message.id, message.offset, message.delta), (300, -2, 128))
+
+    def test_list(self):
+        class Values(steel.Structure):
+            count = steel.Integer(size=1)
+            values = steel.List(steel.ZigZag(), size=count)
+            deltas = steel.List(steel.VLQ(), size=steel.Remainder)
+
+        data = b'\x03\x00\xd7\x04\x01\x00\x81\x80\x00\x7f'
+        for source in (data, io.BytesIO(data)):
+            values = Values(source)
+            self.assertEqual(values.values, [0, -300, -1])
+            self.assertEqual(values.deltas, [0, 0x4000, 0x7f])
+
+    def test_truncated(self):
+        class Values(steel.Structure):
+            first = steel.VarInt()
+            rest = steel.List(steel.VLQ(), size=steel.Remainder)
+
+        # Values that run out partway through aren't finished
+        for data in (b'\xac', b'\x01\x81'):
+            for source in (data, io.BytesIO(data)):
+                with self.assertRaises(EOFError):
+                    Values(source).rest
+
+
 class ListTest(unittest.TestCase):
     encoded_data = b'\x42\x52\x2a\x3a'
     decoded_data = [66, 82, 42, 58]
@@ -247,6 +474,178 @@ class ListTest(unittest.TestCase):
         bytes, data = self.field.read_value(io.BytesIO(self.encoded_data))
         self.assertSequenceEqual(data, self.decoded_data)
 
+    def test_remainder(self):
+        class Histogram(steel.Structure):
+            frequencies = steel.List(steel.Integer(size=2, endianness=steel.LittleEndian), size=steel.Remainder)
+
+        self.assertEqual(Histogram(self.encoded_data).frequencies, [21058, 14890])
+
+        # Signed values that aren't two's complement still work
+        field = steel.List(steel.Integer(size=1, signed=True, signing=steel.SignMagnitude), size=2)
+        bytes, data = field.read_value(io.BytesIO(b'\x82\x02'))
+        self.assertEqual(data, [-2, 2])
+
+    def test_assign(self):
+        class TestStructure(steel.Structure):
+            count = steel.Integer(size=1)
+            items = steel.List(steel.Integer(size=1), size=count)
+
+        struct = TestStructure()
+        with self.assertRaises(ValueError):
+            struct.items = [1, 300]
+
+        # The list is encoded as it was when it was assigned
+        items = [1, 2]
+        struct.items = items
+        items.append(3)
+        self.assertEqual(struct.get_raw_bytes(), b'\x02\x01\x02')
+
+
+class ObjectTest(unittest.TestCase):
+    def setUp(self):
+        class Point(steel.Structure):
+            x = steel.Integer(size=1)
+            y = steel.Integer(size=1)
+
+        class Label(steel.Structure):
+            text = steel.String(encoding='ascii')
+
+        class Shape(steel.Structure):
+            origin = steel.SubStructure(Point)
+            count = steel.Integer(size=1)
+            length = steel.Integer(size=1)
+            label = steel.SubStructure(Label, size=length)
+            name = steel.SubStructure(Label)
+            end = steel.Integer(size=1)
+
+        self.Shape = Shape
+        self.data = b'\x01\x02\x03\x03ab\x00cd\x00\x2a'
+
+    def test_static_size(self):
+        # Static structures are part of the layout, so they can be skipped
+        self.assertIn('origin', self.Shape._layout.offsets)
+        self.assertEqual(self.Shape.origin.get_struct_format(), '2s')
+        self.assertIsNone(self.Shape.name.get_struct_format())
+
+    def test_lazy(self):
+        shape = self.Shape(self.data)
+        self.assertEqual(shape.end, 42)
+        # Neither structure with a known size has been parsed yet
+        self.assertEqual(shape.origin._raw_values, {})
+        self.assertEqual(shape.label._raw_values, {})
+        self.assertEqual(shape.name.text, 'cd')
+
+        self.assertEqual((shape.origin.x, shape.origin.y), (1, 2))
+        self.assertEqual(shape.label.text, 'ab')
+        self.assertIs(shape.origin.get_parent(), shape)
+
+    def test_file(self):
+        shape = self.Shape(io.BytesIO(self.data))
+        self.assertEqual(shape.end, 42)
+        self.assertEqual(shape.label.text, 'ab')
+        self.assertEqual(shape.get_raw_bytes(), self.data)
+
+
+class ConditionTest(unittest.TestCase):
+    class TestStructure(steel.Structure):
+        tag = steel.Integer(size=1)
+        with tag == 1:
+            length = steel.Integer(size=1)
+            with length != 0:
+                content = steel.Bytes(size=length)
+        end = steel.Integer(size=1)
+
+    def test_present(self):
+        struct = self.TestStructure(b'\x01\x02ab\x2a')
+        self.assertEqual(struct.end, 42)
+        self.assertEqual(struct.length, 2)
+        self.assertEqual(struct.content, b'ab')
+        self.assertEqual(struct.get_raw_bytes(), b'\x01\x02ab\x2a')
+
+    def test_absent(self):
+        struct = self.TestStructure(io.BytesIO(b'\x02\x2a'))
+        self.assertEqual(struct.end, 42)
+        with self.assertRaises(AttributeError):
+            struct.length
+        self.assertEqual(struct.get_raw_bytes(), b'\x02\x2a')
+        self.assertEqual(struct.validate(), [])
+
+    def test_nested(self):
+        struct = self.TestStructure(b'\x01\x00\x2a')
+        self.assertEqual(struct.length, 0)
+        self.assertEqual(struct.end, 42)
+        with self.assertRaises(AttributeError):
+            struct.content
+
+    def test_feed(self):
+        struct = self.TestStructure()
+        self.assertFalse(struct.feed(b'\x01\x02a'))
+        self.assertTrue(struct.feed(b'b\x2a'))
+        self.assertEqual(struct.content, b'ab')
+
+    def test_assignment(self):
+        struct = self.TestStructure(tag=2, end=42)
+        self.assertEqual(struct.get_raw_bytes(), b'\x02\x2a')
+
+    def test_duplicate(self):
+        with self.assertRaises(TypeError):
+            class TestStructure(steel.Structure):
+                tag = steel.Integer(size=1)
+                with tag == 1:
+                    value = steel.Integer(size=1)
+                with tag == 2:
+                    value = steel.Integer(size=2)
+
+
+class SwitchTest(unittest.TestCase):
+    def setUp(self):
+        class Ping(steel.Structure):
+            sequence = steel.Integer(size=2)
+
+        class Text(steel.Structure):
+            text = steel.String(encoding='ascii')
+
+        class Message(steel.Structure):
+            opcode = steel.Integer(size=1)
+            length = steel.Integer(size=1)
+            body = steel.Switch(opcode, {1: Ping, 2: Text, 3: steel.Bytes(size=length)})
+            end = steel.Integer(size=1)
+
+        self.Ping = Ping
+        self.Message = Message
+
+    def test_structure(self):
+        message = self.Message(b'\x01\x00\x00\x05\x2a')
+        self.assertIsInstance(message.body, self.Ping)
+        self.assertEqual(message.body.sequence, 5)
+        self.assertEqual(message.end, 42)
+
+        message = self.Message(io.BytesIO(b'\x02\x00hi\x00\x2a'))
+        self.assertEqual(message.body.text, 'hi')
+        self.assertEqual(message.end, 42)
+
+    def test_field(self):
+        message = self.Message(b'\x03\x02ab\x2a')
+        self.assertEqual(bytes(message.body), b'ab')
+        self.assertEqual(message.end, 42)
+
+    def test_unknown(self):
+        message = self.Message(b'\x04\x00\x2a')
+        with self.assertRaises(ValueError):
+            message.body
+
+    def test_fallback(self):
+        class Message(steel.Structure):
+            opcode = steel.Integer(size=1)
+            body = steel.Switch(opcode, {1: self.Ping}, fallback=steel.Bytes(size=1))
+
+        message = Message(b'\x04a')
+        self.assertEqual(bytes(message.body), b'a')
+
+    def test_encode(self):
+        message = self.Message(opcode=3, length=2, body=b'ab', end=42)
+        self.assertEqual(message.get_raw_bytes(), b'\x03\x02ab\x2a')
+
 
 class ZlibTest(unittest.TestCase):
     encoded_data = b'x\x9c+I-.\x01\x00\x04]\x01\xc1'
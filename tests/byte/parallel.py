@@ -0,0 +1,107 @@
+import io
+import os
+import tempfile
+import unittest
+
+import steel
+from steel import parallel
+
+
+class Point(steel.Structure):
+    x = steel.Integer(size=2)
+    steel.Reserved(size=1)
+    y = steel.Integer(size=2)
+
+
+class Message(steel.Structure):
+    length = steel.Integer(size=1)
+    content = steel.Bytes(size=length)
+
+
+class Flagged(steel.Structure):
+    flag = steel.Integer(size=1)
+    with flag == 1:
+        extra = steel.Integer(size=1)
+
+
+class Pair(steel.Structure):
+    a = steel.Integer(size=1)
+    b = steel.Integer(size=1)
+
+
+class Nested(steel.Structure):
+    id = steel.Integer(size=1)
+    pair = steel.SubStructure(Pair)
+
+
+class Items(steel.Structure):
+    count = steel.Integer(size=1)
+    items = steel.List(steel.Bytes(size=2), size=count)
+
+
+class ParallelTest(unittest.TestCase):
+    def write_file(self, data):
+        file = tempfile.NamedTemporaryFile(delete=False)
+        file.write(data)
+        file.close()
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def test_static(self):
+        data = b''.join(i.to_bytes(2, 'big') + b'\x00' + (i * 2).to_bytes(2, 'big') for i in range(1000))
+        path = self.write_file(data)
+        records = list(parallel.parse_parallel(Point, path, max_workers=2, records_per_task=64))
+        self.assertEqual(len(records), 1000)
+        self.assertEqual(records[0], (0, 0))
+        self.assertEqual(records[999].x, 999)
+        self.assertEqual(records[999].y, 1998)
+
+    def test_dynamic(self):
+        contents = [bytes([i % 256]) * (i % 7) for i in range(300)]
+        path = self.write_file(b''.join(bytes([len(c)]) + c for c in contents))
+        records = list(parallel.parse_parallel(Message, path, max_workers=2, records_per_task=50))
+        self.assertEqual([record.content for record in records], contents)
+        self.assertEqual(records[6].length, 6)
+
+    def test_condition(self):
+        path = self.write_file(b'\x01\x05\x00\x01\x07')
+        records = list(parallel.parse_parallel(Flagged, path, max_workers=1, records_per_task=2))
+        self.assertEqual(records, [(1, 5), (0, None), (1, 7)])
+
+    def test_nested(self):
+        path = self.write_file(b'\x01\x02\x03\x04\x05\x06')
+        records = list(parallel.parse_parallel(Nested, path, max_workers=1, records_per_task=1))
+        self.assertEqual(records, [(1, (2, 3)), (4, (5, 6))])
+        self.assertEqual(records[1].pair.b, 6)
+
+    def test_list(self):
+        path = self.write_file(b'\x02abcd\x00\x01ef')
+        records = list(parallel.parse_parallel(Items, path, max_workers=1, records_per_task=2))
+        self.assertEqual(records, [(2, [b'ab', b'cd']), (0, []), (1, [b'ef'])])
+        self.assertIsInstance(records[0].items[0], bytes)
+
+    def test_truncated(self):
+        path = self.write_file(b'\x00\x01\x00\x00\x02\x00\x03')
+        with self.assertRaises(EOFError):
+            list(parallel.parse_parallel(Point, path, max_workers=1))
+
+    def test_empty(self):
+        path = self.write_file(b'')
+        self.assertEqual(list(parallel.parse_parallel(Point, path, max_workers=1)), [])
+
+    def test_streamer_condition(self):
+        streamer = steel.StructureStreamer(Flagged)
+        records = list(streamer.parse(io.BytesIO(b'\x01\x05\x00\x01\x07')))
+        self.assertEqual([record.flag for record in records], [1, 0, 1])
+        self.assertEqual(records[2].extra, 7)
+        self.assertFalse(hasattr(records[1], 'extra'))
+
+    def test_offsets(self):
+        streamer = steel.StructureStreamer(Message)
+        self.assertEqual(list(streamer.find_offsets(b'\x01a\x00\x02bc')), [0, 2, 3, 6])
+        with self.assertRaises(EOFError):
+            streamer.find_offsets(b'\x01a\x03bc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import asyncio
+import unittest
+
+import steel
+from steel import streams
+
+
+class Message(steel.Structure):
+    length = steel.Integer(size=2)
+    content = steel.Bytes(size=length)
+
+
+class Greeting(steel.Structure):
+    id = steel.Integer(size=1)
+    text = steel.String(encoding='ascii')
+
+
+class Varying(steel.Structure):
+    id = steel.Integer(size=1)
+    value = steel.VarInt()
+
+
+class Point(steel.Structure):
+    x = steel.Integer(size=2)
+    y = steel.Integer(size=2)
+
+
+class ParserTest(unittest.TestCase):
+    data = b'\x00\x05hello\x00\x00\x00\x03abc'
+
+    def test_whole(self):
+        parser = streams.StructureParser(Message)
+        records = parser.feed(self.data)
+        self.assertEqual([bytes(record.content) for record in records], [b'hello', b'', b'abc'])
+        self.assertEqual(parser.pending, b'')
+
+    def test_pieces(self):
+        parser = streams.StructureParser(Message)
+        records = []
+        for i in range(len(self.data)):
+            records.extend(parser.feed(self.data[i:i + 1]))
+        self.assertEqual([bytes(record.content) for record in records], [b'hello', b'', b'abc'])
+
+    def test_reused_buffer(self):
+        # Data can come from a buffer that gets overwritten after each read
+        parser = streams.StructureParser(Message)
+        pending = parser.pending
+        data = b'\x10\x00' + b'x' * 4096 + b'\x00\x02ab'
+        buffer = bytearray(100)
+        records = []
+        for start in range(0, len(data), 100):
+            piece = data[start:start + 100]
+            buffer[:len(piece)] = piece
+            records.extend(parser.feed(memoryview(buffer)[:len(piece)]))
+            buffer[:] = b'\xff' * 100
+        self.assertEqual([bytes(record.content) for record in records], [b'x' * 4096, b'ab'])
+
+        # The same buffer gets trimmed as records are finished, not replaced
+        self.assertIs(parser.pending, pending)
+        self.assertEqual(parser.pending, b'')
+
+    def test_parsed_once(self):
+        class CountingBytes(steel.Bytes):
+            reads = 0
+
+            def read(self, file):
+                CountingBytes.reads += 1
+                return super(CountingBytes, self).read(file)
+
+        class Counted(steel.Structure):
+            length = steel.Integer(size=2)
+            content = CountingBytes(size=length)
+
+        parser = streams.StructureParser(Counted)
+        records = parser.feed(self.data[:7]) + parser.feed(bytearray(self.data[7:]))
+        self.assertEqual(CountingBytes.reads, 3)
+
+        # Records are handed out just as they were parsed
+        self.assertEqual([bytes(record.content) for record in records], [b'hello', b'', b'abc'])
+        self.assertEqual(CountingBytes.reads, 3)
+
+    def test_terminated(self):
+        # A string at the end of a record isn't done until its terminator arrives
+        parser = streams.StructureParser(Greeting)
+        self.assertEqual(parser.feed(b'\x01hel'), [])
+        records = parser.feed(b'lo\x00\x02hi\x00')
+        self.assertEqual([(record.id, record.text) for record in records], [(1, 'hello'), (2, 'hi')])
+
+    def test_varint(self):
+        parser = streams.StructureParser(Varying)
+        records = []
+        for byte in b'\x09\xac\x02\x07\x01':
+            records.extend(parser.feed(bytes([byte])))
+        self.assertEqual([(record.id, record.value) for record in records], [(9, 300), (7, 1)])
+
+    def test_needed(self):
+        parser = streams.StructureParser(Message)
+        self.assertEqual(parser.feed(b'\x01\x00abc'), [])
+        self.assertEqual(parser.needed, 258)
+        self.assertEqual(parser.feed(b'x' * 200), [])
+        record, = parser.feed(b'x' * 53 + b'\x00')
+        self.assertEqual(record.length, 256)
+        self.assertEqual(parser.pending, b'\x00')
+
+    def test_static(self):
+        parser = streams.StructureParser(Point)
+        records = parser.feed(b'\x00\x01\x00\x02\x00')
+        self.assertEqual([(record.x, record.y) for record in records], [(1, 2)])
+        records = parser.feed(b'\x03\x00\x04')
+        self.assertEqual([(record.x, record.y) for record in records], [(3, 4)])
+
+
+class FakeTransport:
+    paused = False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+
+class ProtocolTest(unittest.TestCase):
+    def receive(self, protocol, data):
+        buffer = protocol.get_buffer(len(data))
+        buffer[:len(data)] = data
+        protocol.buffer_updated(len(data))
+
+    def test_callback(self):
+        records = []
+        protocol = streams.StructureProtocol(Point, callback=records.append)
+        protocol.connection_made(FakeTransport())
+        self.receive(protocol, b'\x00\x01\x00\x02\x00\x03')
+        self.receive(protocol, b'\x00\x04')
+        self.assertEqual([(record.x, record.y) for record in records], [(1, 2), (3, 4)])
+
+    def test_iteration(self):
+        async def collect():
+            protocol = streams.StructureProtocol(Message)
+            protocol.connection_made(FakeTransport())
+            loop = asyncio.get_running_loop()
+            loop.call_soon(self.receive, protocol, b'\x00\x02hi\x00')
+            loop.call_soon(self.receive, protocol, b'\x03bye')
+            loop.call_soon(protocol.connection_lost, None)
+            return [bytes(record.content) async for record in protocol]
+
+        self.assertEqual(asyncio.run(collect()), [b'hi', b'bye'])
+
+    def test_partial(self):
+        async def collect():
+            protocol = streams.StructureProtocol(Message)
+            protocol.connection_made(FakeTransport())
+            self.receive(protocol, b'\x00\x05hi')
+            protocol.connection_lost(None)
+            return [record async for record in protocol]
+
+        with self.assertRaises(EOFError):
+            asyncio.run(collect())
+
+    def test_flow_control(self):
+        protocol = streams.StructureProtocol(Point, max_records=2)
+        protocol.connection_made(FakeTransport())
+        self.receive(protocol, b'\x00\x01\x00\x02' * 3)
+        self.assertTrue(protocol.transport.paused)
+
+        async def consume():
+            await protocol.__anext__()
+            await protocol.__anext__()
+
+        asyncio.run(consume())
+        self.assertFalse(protocol.transport.paused)
+
+
+class StreamTest(unittest.TestCase):
+    def test_stream_reader(self):
+        async def collect():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'\x00\x02hi\x00\x03b')
+            reader.feed_data(b'ye')
+            reader.feed_eof()
+            return [bytes(record.content) async for record in streams.parse_stream(Message, reader, chunk_size=3)]
+
+        self.assertEqual(asyncio.run(collect()), [b'hi', b'bye'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
 import io
+import mmap
+import os
+import sys
+import tempfile
 import unittest
+import zlib
 
 import steel
+from steel.base import Writer
+from steel.chunks import iff
+from steel.common import codegen
 
 
 class AttributeTest(unittest.TestCase):
@@ -111,6 +119,81 @@ class IOTest(unittest.TestCase):
         self.assertEqual(struct.valid, 'valid')
         self.assertEqual(struct.test, 'test')
 
+    def test_feed(self):
+        struct = self.struct()
+        results = [struct.feed(self.data[i:i + 1]) for i in range(len(self.data))]
+        self.assertEqual(results, [False] * (len(self.data) - 1) + [True])
+        self.assertEqual(struct.forty_two, 42)
+        self.assertEqual(struct.valid, 'valid')
+        self.assertEqual(struct.test, 'test')
+        self.assertEqual(struct.tell(), len(self.data))
+
+    def test_feed_terminated(self):
+        class CountingString(steel.String):
+            reads = 0
+
+            def read(self, file):
+                CountingString.reads += 1
+                return super(CountingString, self).read(file)
+
+        class TestStructure(steel.Structure):
+            id = steel.Integer(size=1)
+            text = CountingString(encoding='ascii')
+
+        data = b'\x01' + b'a' * 10000 + b'\x00'
+        struct = TestStructure()
+        for i in range(len(data) - 1):
+            self.assertFalse(struct.feed(data[i:i + 1]))
+
+        # The string isn't read again until its terminator arrives
+        self.assertEqual(CountingString.reads, 1)
+        self.assertEqual(len(struct._write_buffer), 10000)
+        self.assertTrue(struct.feed(data[-1:]))
+        self.assertEqual(struct.text, 'a' * 10000)
+        self.assertEqual(len(struct._write_buffer), 0)
+
+    def test_feed_list(self):
+        class CountingVarInt(steel.VarInt):
+            scans = 0
+
+            def scan(self, buffer, count):
+                CountingVarInt.scans += 1
+                return super(CountingVarInt, self).scan(buffer, count)
+
+        class TestStructure(steel.Structure):
+            count = steel.Integer(size=2)
+            values = steel.List(CountingVarInt(), size=count)
+
+        values = [i * 100 for i in range(2000)]
+        data = b'\x07\xd0' + b''.join(steel.VarInt().encode(value) for value in values)
+        struct = TestStructure()
+        for i in range(0, len(data), 16):
+            struct.feed(data[i:i + 16])
+        self.assertEqual(struct.values, values)
+
+        # The list isn't scanned again until there could be enough data for it
+        self.assertLess(CountingVarInt.scans, 30)
+
+    def test_feed_related(self):
+        class TestStructure(steel.Structure):
+            length = steel.Integer(size=2)
+            content = steel.Bytes(size=length)
+
+        content = bytes(range(256)) * 4
+        data = b'\x04\x00' + content
+        struct = TestStructure()
+        struct.feed(data[:2])
+        self.assertEqual(struct.length, 1024)
+
+        # Nothing more gets parsed until the whole field is available
+        for i in range(2, len(data) - 10, 10):
+            self.assertFalse(struct.feed(data[i:i + 10]))
+            self.assertEqual(struct._write_needed, 1024)
+        self.assertTrue(struct.feed(data[i + 10:]))
+        self.assertEqual(struct.content, content)
+        self.assertIsInstance(struct.content, bytes)
+        self.assertEqual(len(struct._write_buffer), 0)
+
     def test_attributes(self):
         struct = self.struct(io.BytesIO(self.data))
         self.assertEqual(struct.forty_two, 42)
@@ -144,6 +227,672 @@ class IOTest(unittest.TestCase):
         self.assertEqual(output.getvalue(), self.data)
 
 
+class CountingBytesIO(io.BytesIO):
+    """
+    A BytesIO that keeps track of how many times it was read from.
+    """
+    reads = 0
+
+    def read(self, size=None):
+        self.reads += 1
+        return super(CountingBytesIO, self).read(size)
+
+
+class LayoutTest(unittest.TestCase):
+    data = b'BM\x2a\x00\x00\x00\x00\x00\x00\x42\xff\xfevalidtest\x00'
+
+    def setUp(self):
+        class TestStructure(steel.Structure, endianness=steel.LittleEndian):
+            signature = steel.FixedString('BM')
+            forty_two = steel.Integer(size=4)
+            steel.Reserved(size=2)
+            sixty_six = steel.Integer(size=2, endianness=steel.BigEndian)
+            negative = steel.Integer(size=2, signed=True)
+            valid = steel.String(size=5, encoding='ascii')
+            test = steel.String(encoding='ascii')
+
+        self.struct = TestStructure
+
+    def test_format(self):
+        # Byte order conflicts fall back to raw bytes for the later field
+        self.assertEqual(self.struct._layout.format, '<2sI2s2sh5s')
+        self.assertEqual(self.struct._layout.size, 17)
+
+    def test_single_read(self):
+        file = CountingBytesIO(self.data)
+        struct = self.struct(file)
+        self.assertEqual(struct.valid, 'valid')
+        self.assertEqual(file.reads, 1)
+        self.assertEqual(struct.forty_two, 42)
+        self.assertEqual(struct.sixty_six, 66)
+        self.assertEqual(struct.negative, -257)
+        self.assertEqual(file.reads, 1)
+
+    def test_direct_access(self):
+        struct = self.struct(self.data)
+        self.assertEqual(struct.negative, -257)
+
+        # Only the signature and the field itself were read
+        self.assertEqual(sorted(struct._raw_values), ['negative', 'signature'])
+        self.assertEqual(struct.tell(), 0)
+
+        # Reading further still picks up from the start of the structure
+        self.assertEqual(struct.test, 'test')
+        self.assertEqual(struct.forty_two, 42)
+        self.assertEqual(struct.negative, -257)
+        self.assertEqual(struct.tell(), len(self.data))
+
+    def test_direct_fixed_values(self):
+        struct = self.struct(b'XX' + self.data[2:])
+        with self.assertRaises(ValueError):
+            struct.sixty_six
+
+    def test_dynamic_fields(self):
+        struct = self.struct(io.BytesIO(self.data))
+        self.assertEqual(struct.test, 'test')
+        self.assertEqual(struct.forty_two, 42)
+
+        output = io.BytesIO()
+        struct.save(output)
+        self.assertEqual(output.getvalue(), self.data)
+
+    def test_fixed_values(self):
+        struct = self.struct(io.BytesIO(b'XX' + self.data[2:]))
+        with self.assertRaises(ValueError):
+            struct.forty_two
+
+    def test_short_data(self):
+        struct = self.struct(io.BytesIO(self.data[:6]))
+        self.assertEqual(struct.forty_two, 42)
+
+    def test_assigned_values(self):
+        # Values assigned before reading are left alone by the unpacking
+        struct = self.struct(io.BytesIO(self.data))
+        struct.forty_two = 7
+        self.assertEqual(struct.sixty_six, 66)
+        self.assertEqual(struct.forty_two, 7)
+        self.assertEqual(struct._raw_values['forty_two'], b'\x07\x00\x00\x00')
+
+    def test_later_runs(self):
+        class TestStructure(steel.Structure):
+            name = steel.String(encoding='ascii')
+            width = steel.Integer(size=2)
+            height = steel.Integer(size=2)
+            depth = steel.Integer(size=1)
+            label = steel.String(encoding='ascii')
+            end = steel.Integer(size=1)
+
+        # Single fields are read the same as they always have been
+        self.assertEqual(list(TestStructure._runs), ['width'])
+        self.assertEqual(TestStructure._runs['width'].format, '>HHB')
+
+        data = b'test\x00\x00\x2a\x00\x42\x08ab\x00\x01'
+        file = CountingBytesIO(data)
+        struct = TestStructure(file)
+        self.assertEqual(struct.name, 'test')
+        reads = file.reads
+        self.assertEqual(struct.height, 66)
+        self.assertEqual((struct.width, struct.depth), (42, 8))
+        # All three fields came from a single read
+        self.assertEqual(file.reads, reads + 1)
+        self.assertEqual(struct._get_offsets('height'), (7, 9))
+        self.assertEqual(struct.label, 'ab')
+        self.assertEqual(struct.end, 1)
+
+        # Assigned values still leave the rest of the run in place
+        struct = TestStructure(io.BytesIO(data))
+        struct.height = 7
+        self.assertEqual(struct.depth, 8)
+        self.assertEqual(struct.height, 7)
+        self.assertEqual(struct.label, 'ab')
+
+
+class BufferTest(unittest.TestCase):
+    data = b'\x2a\x00\x42valid\x00\x00\x01\x00\x02test'
+
+    def setUp(self):
+        class TestStructure(steel.Structure):
+            forty_two = steel.Integer(size=2, endianness=steel.LittleEndian)
+            sixty_six = steel.Integer(size=1)
+            valid = steel.String(encoding='ascii')
+            numbers = steel.List(steel.Integer(size=2), size=2)
+            test = steel.Bytes(size=steel.Remainder)
+
+        self.struct = TestStructure
+
+    def assertParsed(self, struct):
+        self.assertEqual(struct.forty_two, 42)
+        self.assertEqual(struct.sixty_six, 66)
+        self.assertEqual(struct.valid, 'valid')
+        self.assertEqual(struct.numbers, [1, 2])
+        self.assertEqual(struct.test, b'test')
+
+    def test_bytes(self):
+        self.assertParsed(self.struct(self.data))
+
+    def test_bytearray(self):
+        self.assertParsed(self.struct(bytearray(self.data)))
+
+    def test_memoryview(self):
+        self.assertParsed(self.struct(memoryview(self.data)))
+
+    def test_mmap(self):
+        buffer = mmap.mmap(-1, len(self.data))
+        buffer.write(self.data)
+        self.assertParsed(self.struct(buffer))
+
+    def test_views(self):
+        struct = self.struct(self.data)
+        self.assertIsInstance(struct.test, memoryview)
+        self.assertIs(struct.test.obj, self.data)
+        self.assertIsInstance(struct._raw_values['numbers'], memoryview)
+
+    def test_save(self):
+        struct = self.struct(self.data)
+        output = io.BytesIO()
+        struct.save(output)
+        self.assertEqual(output.getvalue(), self.data)
+
+
+class OpenTest(unittest.TestCase):
+    data = b'\x2a\x00\x42valid\x00test'
+
+    class TestStructure(steel.Structure):
+        forty_two = steel.Integer(size=2, endianness=steel.LittleEndian)
+        sixty_six = steel.Integer(size=1)
+        valid = steel.String(encoding='ascii')
+        test = steel.Bytes(size=steel.Remainder)
+
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile(delete=False)
+        file.write(self.data)
+        file.close()
+        self.path = file.name
+        self.addCleanup(os.remove, self.path)
+
+    def test_mmap(self):
+        struct = self.TestStructure.open(self.path)
+        self.assertEqual(struct.forty_two, 42)
+        self.assertEqual(struct.valid, 'valid')
+        self.assertIsInstance(struct.test.obj, mmap.mmap)
+        self.assertEqual(struct.test, b'test')
+
+    def test_no_mmap(self):
+        struct = self.TestStructure.open(self.path, mmap=False)
+        self.assertEqual(struct.sixty_six, 66)
+        self.assertEqual(struct.test, b'test')
+
+
+class WriterTest(unittest.TestCase):
+    class TestStructure(steel.Structure):
+        forty_two = steel.Integer(size=2, endianness=steel.LittleEndian)
+        sixty_six = steel.Integer(size=1)
+        valid = steel.String(encoding='ascii')
+
+    data = b'\x2a\x00\x42valid\x00'
+
+    def test_writelines(self):
+        class LinesFile:
+            def __init__(self):
+                self.lines = []
+
+            def writelines(self, lines):
+                self.lines.append(list(lines))
+
+        struct = self.TestStructure(forty_two=42, sixty_six=66, valid='valid')
+        file = LinesFile()
+        struct.save(file)
+
+        # Each field is passed along on its own, all in a single call
+        self.assertEqual(len(file.lines), 1)
+        self.assertEqual(file.lines[0], [b'\x2a\x00', b'\x42', b'valid\x00'])
+
+    def test_write(self):
+        class WriteFile:
+            def __init__(self):
+                self.data = b''
+
+            def write(self, data):
+                self.data += data
+
+        struct = self.TestStructure(io.BytesIO(self.data))
+        file = WriteFile()
+        struct.save(file)
+        self.assertEqual(file.data, self.data)
+
+    def test_undecoded(self):
+        struct = self.TestStructure(io.BytesIO(self.data))
+        struct.sixty_six = 67
+        output = io.BytesIO()
+        struct.save(output)
+        self.assertEqual(output.getvalue(), b'\x2a\x00\x43valid\x00')
+
+        # Fields that weren't assigned are written out without being decoded
+        self.assertNotIn('valid', struct.__dict__)
+
+    def test_chunks(self):
+        @iff.Chunk('NAME')
+        class Name(steel.Structure):
+            text = steel.String(encoding='ascii')
+
+        @iff.Chunk('DATA')
+        class Data(steel.Structure):
+            value = steel.Integer(size=2)
+
+        class Document(steel.Structure):
+            magic = steel.FixedString(b'DOC!')
+            chunks = iff.ChunkList(known_classes=[Name, Data])
+
+        class LinesFile:
+            def __init__(self):
+                self.lines = []
+
+            def writelines(self, lines):
+                self.lines.extend(lines)
+
+        document = Document(chunks=[Name(text='hi'), Data(value=5)])
+        file = LinesFile()
+        document.save(file)
+
+        # Each chunk is passed along in pieces, without joining the list first
+        self.assertEqual(file.lines, [b'DOC!', b'NAME', b'\x00\x00\x00\x03', b'hi\x00',
+                                      b'DATA', b'\x00\x00\x00\x02', b'\x00\x05'])
+        self.assertNotIsInstance(document._raw_values['chunks'], bytes)
+
+    def test_substructure(self):
+        class Point(steel.Structure):
+            x = steel.Integer(size=1)
+            y = steel.Integer(size=1)
+
+        class Line(steel.Structure):
+            start = steel.SubStructure(Point)
+            end = steel.SubStructure(Point)
+
+        class LinesFile:
+            def __init__(self):
+                self.lines = []
+
+            def writelines(self, lines):
+                self.lines.extend(lines)
+
+        line = Line(start=Point(x=1, y=2), end=Point(x=3, y=4))
+        file = LinesFile()
+        line.save(file)
+        self.assertEqual(file.lines, [b'\x01', b'\x02', b'\x03', b'\x04'])
+
+        # The whole value is still there for anything that needs it
+        self.assertEqual(line.dumps(), b'\x01\x02\x03\x04')
+
+    def test_batches(self):
+        output = io.BytesIO()
+        writer = Writer(output, batch_size=2)
+        writer.writelines([b'a', b'b', b'c'])
+        self.assertEqual(output.getvalue(), b'ab')
+        writer.flush()
+        self.assertEqual(output.getvalue(), b'abc')
+
+
+class PatchTest(unittest.TestCase):
+    class TestStructure(steel.Structure):
+        name = steel.String(encoding='ascii')
+        timestamp = steel.Integer(size=4)
+        content = steel.Bytes(size=4)
+        crc = steel.CRC32(first=timestamp)
+
+    data = b'test\x00\x00\x00\x00\x01data\xd4\xf5\xda\xa6'
+
+    class PatchFile(io.BytesIO):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.writes = []
+
+        def write(self, data):
+            self.writes.append((self.tell(), bytes(data)))
+            return super().write(data)
+
+    def expected(self, timestamp):
+        data = timestamp.to_bytes(4, 'big') + b'data'
+        return b'test\x00' + data + zlib.crc32(data).to_bytes(4, 'big')
+
+    def test_patch(self):
+        file = self.PatchFile(self.data)
+        struct = self.TestStructure(file)
+        self.assertEqual(struct.timestamp, 1)
+        struct.timestamp = 2
+        position = file.tell()
+        struct.patch(file)
+
+        # Only the changed field and its checksum get written
+        self.assertEqual(file.getvalue(), self.expected(2))
+        self.assertEqual([offset for offset, data in file.writes], [5, 13])
+        self.assertEqual(file.tell(), position)
+
+        file.writes = []
+        struct.patch(file)
+        self.assertEqual(file.writes, [])
+
+    def test_unread(self):
+        # Fields can be patched without ever having been read
+        file = self.PatchFile(b'head' + self.data)
+        file.seek(4)
+        struct = self.TestStructure(file)
+        struct.timestamp = 3
+        self.assertEqual(struct.content, b'data')
+        struct.patch(file, offset=4)
+        self.assertEqual(file.getvalue(), b'head' + self.expected(3))
+
+    def test_related_size(self):
+        class TestStructure(steel.Structure):
+            length = steel.Integer(size=1)
+            content = steel.Bytes(size=length)
+            trailer = steel.Integer(size=2)
+
+        # The original content is skipped using the original length
+        struct = TestStructure(b'\x03abc\x12\x34')
+        struct.content = b'hello'
+        self.assertEqual(struct.length, 5)
+        self.assertEqual(struct.trailer, 0x1234)
+        self.assertEqual(struct.get_raw_bytes(), b'\x05hello\x12\x34')
+
+    def test_buffer(self):
+        data = bytearray(self.data)
+        struct = self.TestStructure(bytes(data))
+        struct.timestamp = 4
+        struct.patch(data)
+        self.assertEqual(data, self.expected(4))
+
+    def test_new_structure(self):
+        class TestStructure(steel.Structure):
+            name = steel.String(encoding='ascii')
+            timestamp = steel.Integer(size=4)
+
+        # Without any data of its own, the fields are found in the file
+        file = self.PatchFile(self.data)
+        struct = TestStructure()
+        struct.timestamp = 5
+        struct.patch(file)
+        self.assertEqual(file.getvalue(), self.expected(5)[:9] + self.data[9:])
+
+    def test_size_change(self):
+        file = io.BytesIO(self.data)
+        struct = self.TestStructure(file)
+        struct.name = 'longer'
+        with self.assertRaises(ValueError):
+            struct.patch(file)
+        self.assertEqual(file.getvalue(), self.data)
+
+    def test_compact(self):
+        class CompactStructure(steel.Structure, compact=True):
+            width = steel.Integer(size=2)
+            height = steel.Integer(size=2)
+
+        data = bytearray(b'\x02\x80\x01\xe0')
+        struct = CompactStructure(data)
+        struct.height = 768
+        struct.patch(data)
+        self.assertEqual(data, b'\x02\x80\x03\x00')
+
+
+class CompactTest(unittest.TestCase):
+    data = b'RGB\x2a\x00\x42\xff\xfe'
+
+    class TestStructure(steel.Structure, compact=True):
+        signature = steel.FixedString('RGB')
+        forty_two = steel.Integer(size=2, endianness=steel.LittleEndian)
+        sixty_six = steel.Integer(size=1)
+        negative = steel.Integer(size=2, signed=True)
+
+    def test_slots(self):
+        struct = self.TestStructure(self.data)
+        self.assertFalse(hasattr(struct, '__dict__'))
+        self.assertEqual(struct._data, self.data)
+        with self.assertRaises(AttributeError):
+            struct.other = 1
+
+    def test_subclass_slots(self):
+        class SubStructure(self.TestStructure):
+            extra = steel.Integer(size=1)
+
+        # The slots are only declared once, so instances don't get any bigger
+        self.assertEqual(SubStructure.__slots__, ())
+        struct = SubStructure(self.data + b'\x07')
+        self.assertEqual(struct.extra, 7)
+        self.assertEqual(sys.getsizeof(struct), sys.getsizeof(self.TestStructure(self.data)))
+
+    def test_read(self):
+        struct = self.TestStructure(io.BytesIO(self.data + b'extra'))
+        self.assertEqual(struct.signature, 'RGB')
+        self.assertEqual(struct.forty_two, 42)
+        self.assertEqual(struct.sixty_six, 66)
+        self.assertEqual(struct.negative, -2)
+
+    def test_fields(self):
+        self.assertIsInstance(self.TestStructure.forty_two, steel.Integer)
+        self.assertEqual(list(self.TestStructure._fields), ['signature', 'forty_two', 'sixty_six', 'negative'])
+
+    def test_short_data(self):
+        with self.assertRaises(EOFError):
+            self.TestStructure(self.data[:4])
+
+    def test_fixed_values(self):
+        struct = self.TestStructure(b'XYZ' + self.data[3:])
+        self.assertEqual(struct.forty_two, 42)
+        with self.assertRaises(ValueError):
+            struct.signature
+
+    def test_assignment(self):
+        struct = self.TestStructure(self.data)
+        struct.forty_two = 37
+        self.assertEqual(struct.forty_two, 37)
+        self.assertEqual(struct.get_raw_bytes(), b'RGB\x25\x00\x42\xff\xfe')
+
+        struct = self.TestStructure(forty_two=42, sixty_six=66, negative=-2)
+        output = io.BytesIO()
+        struct.save(output)
+        self.assertEqual(output.getvalue(), self.data)
+
+    def test_empty(self):
+        class TestStructure(steel.Structure, compact=True):
+            a = steel.Integer(size=1)
+            b = steel.Integer(size=1)
+            c = steel.Integer(size=1, default=7)
+
+        self.assertEqual(TestStructure().get_raw_bytes(), b'\x00\x00\x07')
+
+        # Fields that weren't supplied keep their defaults
+        struct = TestStructure(a=1)
+        self.assertEqual((struct.a, struct.b, struct.c), (1, 0, 7))
+        struct = TestStructure(c=3)
+        self.assertEqual(struct.get_raw_bytes(), b'\x00\x00\x03')
+
+    def test_dynamic_fields(self):
+        with self.assertRaises(TypeError):
+            class TestStructure(steel.Structure, compact=True):
+                name = steel.String(encoding='ascii')
+
+    def test_subclass(self):
+        class TestStructure(self.TestStructure):
+            extra = steel.Integer(size=1)
+
+        struct = TestStructure(self.data + b'\x07')
+        self.assertFalse(hasattr(struct, '__dict__'))
+        self.assertEqual(struct.negative, -2)
+        self.assertEqual(struct.extra, 7)
+
+    def test_streamer(self):
+        streamer = steel.StructureStreamer(self.TestStructure)
+        records = list(streamer.parse(io.BytesIO(self.data * 3)))
+        self.assertEqual([record.forty_two for record in records], [42, 42, 42])
+
+
+class UnpackTest(unittest.TestCase):
+    data = b'RGB\x2a\x00\x00\x42validRGB\x07\x00\x00\x08test\x00'
+
+    class TestStructure(steel.Structure):
+        signature = steel.FixedString('RGB')
+        forty_two = steel.Integer(size=2, endianness=steel.LittleEndian)
+        steel.Reserved(size=1)
+        sixty_six = steel.Integer(size=1)
+        valid = steel.String(size=5, encoding='ascii')
+
+    def test_iter_unpack(self):
+        records = list(self.TestStructure.iter_unpack(self.data))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0], ('RGB', 42, 66, 'valid'))
+        self.assertEqual(records[1].forty_two, 7)
+        self.assertEqual(records[1].valid, 'test')
+        self.assertEqual(records[1]._fields, ('signature', 'forty_two', 'sixty_six', 'valid'))
+
+    def test_unpack_many(self):
+        records = self.TestStructure.unpack_many(self.data, 1)
+        self.assertEqual(records, [('RGB', 42, 66, 'valid')])
+
+        file = io.BytesIO(self.data)
+        self.assertEqual(len(self.TestStructure.unpack_many(file, 2)), 2)
+
+        with self.assertRaises(EOFError):
+            self.TestStructure.unpack_many(self.data, 3)
+
+    def test_fixed_values(self):
+        with self.assertRaises(ValueError):
+            list(self.TestStructure.iter_unpack(b'XYZ' + self.data[3:]))
+
+    def test_dynamic_fields(self):
+        class TestStructure(steel.Structure):
+            name = steel.String(encoding='ascii')
+
+        with self.assertRaises(TypeError):
+            list(TestStructure.iter_unpack(self.data))
+
+
+class CodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(setattr, codegen, 'CACHE_DIR', codegen.CACHE_DIR)
+        self.addCleanup(setattr, codegen, 'code_cache', codegen.code_cache)
+        codegen.CACHE_DIR = self.cache_dir
+        codegen.code_cache = {}
+
+    def tearDown(self):
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+        os.rmdir(self.cache_dir)
+
+    def get_structure(self):
+        class TestStructure(steel.Structure):
+            cached_value = steel.Integer(size=2)
+            other_value = steel.Integer(size=1)
+        return TestStructure
+
+    def test_cache(self):
+        # Nothing gets compiled until the structure is actually used
+        TestStructure = self.get_structure()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+        TestStructure(io.BytesIO(b'\x00\x2a\x42')).cached_value
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # Loading it back from the disk works just the same
+        codegen.code_cache = {}
+        struct = self.get_structure()(io.BytesIO(b'\x00\x2a\x42'))
+        self.assertEqual(struct.cached_value, 42)
+        self.assertEqual(struct.other_value, 66)
+
+    def test_corrupt_cache(self):
+        self.get_structure()(io.BytesIO(b'\x00\x2a\x42')).cached_value
+        name, = os.listdir(self.cache_dir)
+        with open(os.path.join(self.cache_dir, name), 'wb') as file:
+            file.write(b'invalid')
+
+        codegen.code_cache = {}
+        struct = self.get_structure()(io.BytesIO(b'\x00\x2a\x42'))
+        self.assertEqual(struct.cached_value, 42)
+
+
+class IndexTest(unittest.TestCase):
+    class TestStructure(steel.Structure):
+        number = steel.Integer(size=2)
+        length = steel.Integer(size=1)
+        content = steel.Bytes(size=length)
+
+    def setUp(self):
+        self.contents = [b'x' * (i % 5) for i in range(100)]
+        data = b''.join(i.to_bytes(2, 'big') + bytes([len(c)]) + c for i, c in enumerate(self.contents))
+        file = tempfile.NamedTemporaryFile(delete=False)
+        file.write(data)
+        file.close()
+        self.path = file.name
+        self.addCleanup(os.remove, self.path)
+        self.addCleanup(self.remove_index)
+
+    def remove_index(self):
+        if os.path.exists(self.path + '.index'):
+            os.remove(self.path + '.index')
+
+    def test_build_index(self):
+        streamer = steel.StructureStreamer(self.TestStructure)
+        index_path = streamer.build_index(self.path, keys=['number'])
+        self.assertEqual(index_path, self.path + '.index')
+
+        stream = streamer.open_indexed(self.path)
+        self.assertEqual(len(stream), 100)
+        self.assertEqual(stream[42].number, 42)
+        self.assertEqual(stream[42].content, self.contents[42])
+        self.assertEqual(stream[-1].number, 99)
+        self.assertEqual(list(stream.keys['number']), list(range(100)))
+        with self.assertRaises(IndexError):
+            stream[100]
+
+    def test_slicing(self):
+        stream = steel.StructureStreamer(self.TestStructure).open_indexed(self.path)
+        self.assertEqual([record.number for record in stream[10:20:3]], [10, 13, 16, 19])
+        self.assertEqual(len(list(stream)), 100)
+
+    def test_stale_index(self):
+        streamer = steel.StructureStreamer(self.TestStructure)
+        streamer.build_index(self.path)
+        with open(self.path, 'ab') as file:
+            file.write(b'\x00\x64\x01y')
+
+        stream = streamer.open_indexed(self.path)
+        self.assertEqual(len(stream), 101)
+        self.assertEqual(stream[100].content, b'y')
+
+    def test_edited_in_place(self):
+        streamer = steel.StructureStreamer(self.TestStructure)
+        streamer.build_index(self.path)
+        # The first record takes in the whole second one, without changing
+        # the size of the file, as patch() would do
+        with open(self.path, 'r+b') as file:
+            file.seek(2)
+            file.write(b'\x04')
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+        stream = streamer.open_indexed(self.path)
+        self.assertEqual(len(stream), 99)
+        self.assertEqual(stream[0].content, b'\x00\x01\x01x')
+        self.assertEqual(stream[1].number, 2)
+
+    def test_missing_keys(self):
+        streamer = steel.StructureStreamer(self.TestStructure)
+        streamer.build_index(self.path)
+        stream = streamer.open_indexed(self.path, keys=['length'])
+        self.assertEqual(stream.keys['length'][4], 4)
+
+    def test_kept_keys(self):
+        streamer = steel.StructureStreamer(self.TestStructure)
+        streamer.open_indexed(self.path, keys=['number'])
+        stream = streamer.open_indexed(self.path, keys=['length'])
+
+        # Keys from before are rebuilt along with the new ones
+        self.assertEqual(sorted(stream.keys), ['length', 'number'])
+        mtime = os.stat(self.path + '.index').st_mtime_ns
+        stream = streamer.open_indexed(self.path, keys=['number'])
+        self.assertEqual(stream.keys['number'][42], 42)
+        self.assertEqual(os.stat(self.path + '.index').st_mtime_ns, mtime)
+
+
 class OptionsTest(unittest.TestCase):
     def test_arguments(self):
         class TestStructure(steel.Structure, attribute='test'):